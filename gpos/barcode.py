@@ -0,0 +1,332 @@
+import json
+
+import frappe
+from frappe.utils import cint, flt
+from werkzeug.wrappers import Response
+
+from gpos.gpos.catalog_index import get_catalog_index
+from gpos.gpos.price_matrix import (
+    get_pos_price_list,
+    get_price_lookup,
+    is_selling_price_list,
+    price_list_not_allowed,
+)
+from gpos.gpos.settings import get_settings, get_settings_version
+
+# The barcode index is a plain dict kept per worker and per site. A version
+# stamp in the shared cache tells a worker its copy is stale; document events
+# change the stamp and each worker rebuilds on its next lookup. Prices come
+# from the price matrix. Lookups read the shared catalog index instead, and only
+# fall back to these per-worker copies when there is none for today.
+
+BARCODE_INDEX_VERSION = "gpos_barcode_index_version"
+
+_barcode_indexes = {}
+_scale_barcode_parsers = {}
+
+
+def bump_barcode_index_version():
+    frappe.cache().set_value(BARCODE_INDEX_VERSION, frappe.generate_hash(length=10))
+
+
+def get_index_version(key):
+    version = frappe.cache().get_value(key)
+    if not version:
+        version = frappe.generate_hash(length=10)
+        frappe.cache().set_value(key, version)
+    return version
+
+
+def build_barcode_index(barcodes=None):
+    """
+    {barcode: (item_code, item_name, uom, conversion_factor, editable_price, editable_quantity)}
+
+    A barcode without a UOM resolves to the item's stock UOM. With `barcodes`
+    only those barcodes are read.
+    """
+    barcode_filters = {"parenttype": "Item"}
+    if barcodes is not None:
+        barcode_filters["barcode"] = ["in", list(barcodes)]
+    rows = frappe.get_all(
+        "Item Barcode",
+        filters=barcode_filters,
+        fields=["parent", "barcode", "uom", "custom_editable_price", "custom_editable_quantity"],
+    )
+
+    item_filters = {}
+    conversion_filters = {"parenttype": "Item"}
+    if barcodes is not None:
+        if not rows:
+            return {}
+        item_codes = list({row.parent for row in rows})
+        item_filters["name"] = ["in", item_codes]
+        conversion_filters["parent"] = ["in", item_codes]
+
+    items = {
+        item.name: item
+        for item in frappe.get_all("Item", filters=item_filters, fields=["name", "item_name", "stock_uom"])
+    }
+    conversion_factors = {
+        (row.parent, row.uom): row.conversion_factor
+        for row in frappe.get_all(
+            "UOM Conversion Detail",
+            filters=conversion_filters,
+            fields=["parent", "uom", "conversion_factor"],
+        )
+    }
+
+    index = {}
+    for barcode in rows:
+        item = items.get(barcode.parent)
+        if not item:
+            continue
+        uom = barcode.uom or item.stock_uom
+        index[barcode.barcode] = (
+            item.name,
+            item.item_name,
+            uom,
+            conversion_factors.get((item.name, uom), 1.0),
+            bool(barcode.custom_editable_price),
+            bool(barcode.custom_editable_quantity),
+        )
+    return index
+
+
+def get_barcode_index():
+    version = get_index_version(BARCODE_INDEX_VERSION)
+    cached = _barcode_indexes.get(frappe.local.site)
+    if not cached or cached[0] != version:
+        cached = (version, build_barcode_index())
+        _barcode_indexes[frappe.local.site] = cached
+    return cached[1]
+
+
+def get_barcode_lookup():
+    index = get_catalog_index()
+    return index.get_barcodes() if index else get_barcode_index()
+
+
+def resolve(barcode, barcode_index, price_matrix):
+    entry = barcode_index.get(barcode)
+    if not entry:
+        return None
+    item_code, item_name, uom, conversion_factor, editable_price, editable_quantity = entry
+    return {
+        "barcode": barcode,
+        "item_code": item_code,
+        "item_name": item_name,
+        "uom": uom,
+        "conversion_factor": conversion_factor,
+        "price": round(price_matrix.get(item_code, {}).get(uom, 0.0), 2),
+        "editable_price": editable_price,
+        "editable_quantity": editable_quantity,
+    }
+
+
+def compile_scale_barcode_parser(settings):
+    """
+    Turns the barcode section of Claudion POS setting into a parse function.
+
+    When the prefix is included, the barcode starts with no_of_prefix_character
+    prefix characters and the 1-based positions in the settings count from the
+    first character after them, as the terminals read them. The parse function
+    returns (item_code, weight, price) for a scale barcode, price being None
+    when it is not embedded, or None when the barcode does not match the layout.
+    """
+    prefix = ""
+    prefix_length = 0
+    if settings.prefix_included_or_not:
+        prefix = settings.prefix or ""
+        prefix_length = cint(settings.no_of_prefix_character) or len(prefix)
+        prefix = prefix[:prefix_length]
+
+    def segment(start, digits):
+        start = prefix_length + max(cint(start) - 1, 0)
+        return slice(start, start + digits)
+
+    item_code_slice = segment(settings.item_code_starting_position, cint(settings.item_code_total_digits))
+
+    weight_decimals = cint(settings.no_of_decimal_in_weights)
+    weight_slice = segment(
+        settings.weight_starting_position,
+        cint(settings.weight_total_digitsexcluding_decimal) + weight_decimals,
+    )
+    weight_divisor = 10 ** weight_decimals
+
+    price_slice = None
+    price_divisor = 1
+    if settings.price_included_in_barcode_or_not:
+        price_decimals = cint(settings.no_of_decimal_in_price)
+        price_slice = segment(
+            settings.price_starting_position,
+            cint(settings.price_total_digitsexcluding_decimals) + price_decimals,
+        )
+        price_divisor = 10 ** price_decimals
+
+    min_length = max(item_code_slice.stop, weight_slice.stop, price_slice.stop if price_slice else 0)
+
+    def parse(barcode):
+        if len(barcode) < min_length or not barcode.startswith(prefix):
+            return None
+        try:
+            weight = int(barcode[weight_slice]) / weight_divisor if weight_slice.stop > weight_slice.start else None
+            price = int(barcode[price_slice]) / price_divisor if price_slice else None
+        except ValueError:
+            return None
+        return barcode[item_code_slice], weight, price
+
+    return parse
+
+
+def get_scale_barcode_parser():
+    key = (frappe.local.site, get_settings_version("Claudion POS setting"))
+    parse = _scale_barcode_parsers.get(key)
+    if not parse:
+        parse = compile_scale_barcode_parser(get_settings("Claudion POS setting"))
+        _scale_barcode_parsers[key] = parse
+    return parse
+
+
+def decode_scale_barcode_list(barcodes, price_list):
+    """
+    Decodes scale barcodes and joins them to their items.
+
+    The item code part is looked up in the barcode index first, then as an Item
+    code. When the barcode carries no price, price is weight times the UOM price.
+    Returns (decoded, not_found).
+    """
+    parse = get_scale_barcode_parser()
+    barcode_index = get_barcode_lookup()
+    price_matrix = get_price_lookup(price_list)
+
+    parsed = []
+    not_found = []
+    for barcode in barcodes:
+        result = parse(barcode)
+        if result:
+            parsed.append((barcode, *result))
+        else:
+            not_found.append(barcode)
+
+    item_codes = {item_code for _, item_code, _, _ in parsed if item_code not in barcode_index}
+    items = {}
+    if item_codes:
+        items = {
+            item.name: item
+            for item in frappe.get_all(
+                "Item",
+                filters={"name": ["in", list(item_codes)]},
+                fields=["name", "item_name", "stock_uom"],
+            )
+        }
+
+    decoded = []
+    for barcode, item_code, weight, price in parsed:
+        if item_code in barcode_index:
+            item_code, item_name, uom = barcode_index[item_code][:3]
+        elif item_code in items:
+            item_name, uom = items[item_code].item_name, items[item_code].stock_uom
+        else:
+            not_found.append(barcode)
+            continue
+
+        unit_price = flt(price_matrix.get(item_code, {}).get(uom, 0.0))
+        decoded.append(
+            {
+                "barcode": barcode,
+                "item_code": item_code,
+                "item_name": item_name,
+                "uom": uom,
+                "weight": weight,
+                "unit_price": round(unit_price, 2),
+                "price": price if price is not None else round(unit_price * (weight or 0), 2),
+            }
+        )
+    return decoded, not_found
+
+
+def on_item_change(doc, method=None):
+    # After commit, or workers rebuilding in between would cache the old
+    # barcodes under the new version.
+    frappe.db.after_commit.add(bump_barcode_index_version)
+
+
+@frappe.whitelist(allow_guest=True)
+def resolve_barcode(barcode, pos_profile=None, price_list=None):
+    """
+    Resolves one scanned barcode to its item, UOM, conversion factor and price.
+    """
+    if price_list and not is_selling_price_list(price_list):
+        return price_list_not_allowed(price_list)
+    price_list = price_list or get_pos_price_list(pos_profile)
+    data = resolve(barcode, get_barcode_lookup(), get_price_lookup(price_list))
+    if not data:
+        return Response(
+            json.dumps({"error": "Barcode not found"}),
+            status=404,
+            mimetype="application/json",
+        )
+    return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
+
+
+@frappe.whitelist(allow_guest=True)
+def resolve_barcodes(barcodes, pos_profile=None, price_list=None):
+    """
+    Batch variant of resolve_barcode. `barcodes` is a JSON list of barcodes.
+    """
+    if price_list and not is_selling_price_list(price_list):
+        return price_list_not_allowed(price_list)
+    try:
+        barcodes = json.loads(barcodes) if isinstance(barcodes, str) else barcodes
+    except json.JSONDecodeError:
+        return Response(
+            json.dumps({"error": "barcodes must be a JSON list"}),
+            status=400,
+            mimetype="application/json",
+        )
+
+    price_list = price_list or get_pos_price_list(pos_profile)
+    barcode_index = get_barcode_lookup()
+    price_matrix = get_price_lookup(price_list)
+
+    data = []
+    not_found = []
+    for barcode in barcodes or []:
+        resolved = resolve(barcode, barcode_index, price_matrix)
+        if resolved:
+            data.append(resolved)
+        else:
+            not_found.append(barcode)
+
+    return Response(
+        json.dumps({"data": data, "not_found": not_found}),
+        status=200,
+        mimetype="application/json",
+    )
+
+
+@frappe.whitelist(allow_guest=True)
+def decode_scale_barcodes(barcodes, pos_profile=None, price_list=None):
+    """
+    Decodes a JSON list of weight/price embedded scale barcodes using the
+    layout in Claudion POS setting.
+    """
+    if price_list and not is_selling_price_list(price_list):
+        return price_list_not_allowed(price_list)
+    try:
+        barcodes = json.loads(barcodes) if isinstance(barcodes, str) else barcodes
+    except json.JSONDecodeError:
+        return Response(
+            json.dumps({"error": "barcodes must be a JSON list"}),
+            status=400,
+            mimetype="application/json",
+        )
+
+    decoded, not_found = decode_scale_barcode_list(
+        barcodes or [], price_list or get_pos_price_list(pos_profile)
+    )
+    return Response(
+        json.dumps({"data": decoded, "not_found": not_found}),
+        status=200,
+        mimetype="application/json",
+    )
@@ -0,0 +1,808 @@
+import base64
+import hashlib
+import json
+import time
+from functools import partial
+
+import frappe
+from frappe.utils import cint, getdate, now_datetime
+
+from gpos.gpos.price_matrix import (
+    DEFAULT_PRICE_LIST,
+    get_pos_price_list,
+    get_price_matrix,
+    get_price_schedules,
+)
+
+CHANGE_LOG = "Catalog Change Log"
+
+ITEM_GROUP_SUBTREES = "gpos_item_group_subtrees"
+
+ITEM_FIELDS = ["name", "stock_uom", "item_name", "item_group", "description", "modified", "disabled"]
+
+# Custom fields that are not shipped with the app fixtures, only fetched when the site has them.
+OPTIONAL_ITEM_FIELDS = ["custom_item_name_arabic", "custom_item_name_in_english"]
+
+# Projections a terminal can ask the catalog endpoints for. "full" is the
+# get_items shape, the others only carry the item code and one child table.
+CATALOG_FIELDS = ("full", "prices", "barcodes")
+PROJECTION_ITEM_FIELDS = ["name", "item_group", "disabled"]
+
+
+def get_item_group_subtree(item_group):
+    """
+    The item group and all its descendants, read from the lft/rgt nested set.
+    Cached per group until an Item Group changes.
+    """
+    def build():
+        bounds = frappe.db.get_value("Item Group", item_group, ["lft", "rgt"])
+        if not bounds:
+            return []
+        lft, rgt = bounds
+        return frappe.get_all(
+            "Item Group",
+            filters={"lft": [">=", lft], "rgt": ["<=", rgt]},
+            pluck="name",
+        )
+
+    return frappe.cache().hget(ITEM_GROUP_SUBTREES, item_group, generator=build)
+
+
+def expand_item_groups(item_groups):
+    expanded = []
+    for item_group in item_groups:
+        for name in get_item_group_subtree(item_group):
+            if name not in expanded:
+                expanded.append(name)
+    return expanded
+
+
+def get_pos_item_groups(pos_profile=None):
+    """
+    Item groups of the POS Profile including their subgroups, empty when the
+    profile does not restrict item groups.
+    """
+    if not pos_profile:
+        return []
+    return expand_item_groups(
+        frappe.get_all(
+            "POS Item Group",
+            filters={"parent": pos_profile, "parenttype": "POS Profile"},
+            pluck="item_group",
+        )
+    )
+
+
+def get_catalog_item_groups(pos_profile=None, item_group=None):
+    """
+    Item groups a catalog request is limited to, None when it is not limited.
+    An empty list means nothing matches.
+    """
+    item_groups = get_pos_item_groups(pos_profile) or None
+    if item_group:
+        subtree = get_item_group_subtree(item_group)
+        item_groups = [name for name in subtree if item_groups is None or name in item_groups]
+    return item_groups
+
+
+def get_pos_profile_changes(item_groups=None, price_lists=None):
+    """
+    {pos_profile: {"item_groups": [...], "price_lists": [...]}} of the enabled
+    POS Profiles whose catalog contains any of the item groups or that sell
+    from one of the price lists, with the ones that concern each profile.
+    """
+    item_groups = set(item_groups or [])
+    price_lists = set(price_lists or [])
+    changes = {}
+    for pos_profile in frappe.get_all(
+        "POS Profile", filters={"disabled": 0}, fields=["name", "selling_price_list"]
+    ):
+        change = {}
+        price_list = pos_profile.selling_price_list or DEFAULT_PRICE_LIST
+        if price_list in price_lists:
+            change["price_lists"] = [price_list]
+        if item_groups:
+            profile_groups = get_pos_item_groups(pos_profile.name)
+            matched = item_groups.intersection(profile_groups) if profile_groups else item_groups
+            if matched:
+                change["item_groups"] = sorted(matched)
+        if change:
+            changes[pos_profile.name] = change
+    return changes
+
+
+def get_last_change_seq():
+    """
+    Sequence of the latest sequenced Catalog Change Log entry, the cursor for
+    catalog_sync.get_catalog_changes.
+
+    Sequences are given to entries once they are committed, in the order they
+    are sequenced, so an entry never becomes visible below a cursor a terminal
+    already holds.
+    """
+    return cint(frappe.db.sql(f"select max(seq) from `tab{CHANGE_LOG}`")[0][0])
+
+
+def encode_page_token(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("utf-8")
+
+
+def decode_page_token(page_token):
+    """
+    Reads a token made by encode_page_token, raising ValueError when it was tampered with.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(page_token.encode("utf-8")))
+        return {
+            "item_group": str(position["item_group"]),
+            "name": str(position["name"]),
+            "total": int(position["total"]),
+            "seen": int(position["seen"]),
+        }
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError("Invalid page token") from e
+
+
+def get_item_fields(fields="full"):
+    if fields != "full":
+        return PROJECTION_ITEM_FIELDS
+    item_meta = frappe.get_meta("Item")
+    return ITEM_FIELDS + [
+        fieldname for fieldname in OPTIONAL_ITEM_FIELDS if item_meta.has_field(fieldname)
+    ]
+
+
+def get_item_names(item):
+    """
+    Returns (item_name_english, item_name_arabic) from whichever custom name field is filled.
+    """
+    if item.get("custom_item_name_arabic"):
+        return item.item_name, item.custom_item_name_arabic
+    if item.get("custom_item_name_in_english"):
+        return item.custom_item_name_in_english, item.item_name
+    return "", ""
+
+
+def group_by(rows, key):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(row)
+    return grouped
+
+
+def get_item_child_rows(doctype, item_codes, fields):
+    if not item_codes:
+        return {}
+    rows = frappe.get_all(
+        doctype,
+        filters={"parenttype": "Item", "parent": ["in", item_codes]},
+        fields=["parent"] + fields,
+    )
+    return group_by(rows, "parent")
+
+
+def get_price_map(item_codes, price_list):
+    """
+    {item_code: {uom: price_list_rate}}, read from the price matrix of the price list.
+    """
+    matrix = get_price_matrix(price_list)
+    return {item_code: matrix[item_code] for item_code in item_codes if item_code in matrix}
+
+
+def get_price_schedule_map(item_codes, price_list):
+    """
+    {item_code: {uom: [{"from": date, "price": rate}]}} of the items with upcoming price changes.
+    """
+    schedules = get_price_schedules(price_list)
+    return {item_code: schedules[item_code] for item_code in item_codes if item_code in schedules}
+
+
+def get_uom_flags(uom_names):
+    if not uom_names:
+        return {}
+    uoms = frappe.get_all(
+        "UOM",
+        filters={"name": ["in", list(uom_names)]},
+        fields=["name", "custom_editable_price", "custom_editable_quantity"],
+    )
+    return {uom.name: uom for uom in uoms}
+
+
+def get_disabled_item_groups(item_groups):
+    if not item_groups:
+        return set()
+    return set(
+        frappe.get_all(
+            "Item Group",
+            filters={"name": ["in", list(item_groups)], "custom_disabled": 1},
+            pluck="name",
+        )
+    )
+
+
+def iter_item_batches(item_groups=None, batch_size=500, fields="full"):
+    """
+    Yields the catalog Item rows in batches ordered by item group and item code.
+
+    Each batch seeks past the last row of the previous one, so only one batch
+    is held in memory at a time.
+    """
+    columns = ", ".join(f"`{field}`" for field in get_item_fields(fields))
+    conditions = []
+    values = {"batch_size": batch_size}
+    if item_groups:
+        conditions.append("item_group in %(item_groups)s")
+        values["item_groups"] = tuple(item_groups)
+
+    after = None
+    while True:
+        seek = list(conditions)
+        if after:
+            seek.append(
+                "item_group >= %(after_group)s"
+                " and (item_group > %(after_group)s"
+                " or (item_group = %(after_group)s and name > %(after_name)s))"
+            )
+            values.update(after_group=after.item_group, after_name=after.name)
+
+        items = frappe.db.sql(
+            f"""
+            select {columns}
+            from `tabItem`
+            where {" and ".join(seek) or "1=1"}
+            order by item_group, name
+            limit %(batch_size)s
+            """,
+            values,
+            as_dict=True,
+        )
+        if not items:
+            return
+        yield items
+        if len(items) < batch_size:
+            return
+        after = items[-1]
+
+
+def build_grouped_items(items, price_list, fields="full"):
+    """
+    Builds the get_items payload for the given Item rows.
+
+    Child rows, prices, UOM flags and item group flags are each fetched with a
+    single query and joined in memory, so the number of queries does not grow
+    with the number of items. With `fields` set to "prices" or "barcodes" only
+    that child table is fetched and serialized.
+    """
+    disabled_groups = get_disabled_item_groups({item.item_group for item in items})
+    item_codes = [item.name for item in items if item.item_group not in disabled_groups]
+
+    uoms_by_item = {}
+    if fields in ("full", "prices"):
+        uoms_by_item = get_item_child_rows(
+            "UOM Conversion Detail", item_codes, ["name", "uom", "conversion_factor"]
+        )
+    barcodes_by_item = {}
+    if fields in ("full", "barcodes"):
+        barcodes_by_item = get_item_child_rows(
+            "Item Barcode",
+            item_codes,
+            ["name", "barcode", "uom", "custom_editable_price", "custom_editable_quantity"],
+        )
+    price_map = {}
+    schedule_map = {}
+    if fields in ("full", "prices"):
+        price_map = get_price_map(item_codes, price_list)
+        schedule_map = get_price_schedule_map(item_codes, price_list)
+    uom_flags = {}
+    if fields == "full":
+        uom_flags = get_uom_flags(
+            {uom.uom for uoms in uoms_by_item.values() for uom in uoms}
+        )
+
+    grouped_items = {}
+
+    for item in items:
+        item_group_disabled = item.item_group in disabled_groups
+
+        if item.item_group not in grouped_items:
+            grouped_items[item.item_group] = {
+                "item_group_id": item.item_group,
+                "item_group": item.item_group,
+                "item_group_disabled": item_group_disabled,
+                "items": [],
+                "disabled": item.disabled,
+            }
+
+        if item_group_disabled:
+            continue
+
+        if fields == "prices":
+            serialized = serialize_item_prices(
+                item,
+                uoms_by_item.get(item.name, []),
+                price_map.get(item.name, {}),
+                schedule_map.get(item.name, {}),
+            )
+        elif fields == "barcodes":
+            serialized = serialize_item_barcodes(item, barcodes_by_item.get(item.name, []))
+        else:
+            serialized = serialize_item(
+                item,
+                uoms_by_item.get(item.name, []),
+                barcodes_by_item.get(item.name, []),
+                price_map.get(item.name, {}),
+                uom_flags,
+                schedule_map.get(item.name, {}),
+            )
+        grouped_items[item.item_group]["items"].append(serialized)
+
+    return list(grouped_items.values())
+
+
+def serialize_item_prices(item, uoms, prices, schedules):
+    return {
+        "item_code": item.name,
+        "uom": [
+            {
+                "uom": uom.uom,
+                "price": round(prices.get(uom.uom, 0.0), 2),
+                "price_schedule": serialize_price_schedule(schedules.get(uom.uom, [])),
+            }
+            for uom in uoms
+        ],
+    }
+
+
+def serialize_price_schedule(schedule):
+    return [
+        {"from": change["from"], "price": None if change["price"] is None else round(change["price"], 2)}
+        for change in schedule
+    ]
+
+
+def serialize_item_barcodes(item, barcodes):
+    return {
+        "item_code": item.name,
+        "barcodes": [
+            {"id": barcode.name, "barcode": barcode.barcode, "uom": barcode.uom}
+            for barcode in barcodes
+        ],
+    }
+
+
+def serialize_item(item, uoms, barcodes, prices, uom_flags, schedules=None):
+    item_name_english, item_name_arabic = get_item_names(item)
+
+    barcode_map = {}
+    for barcode in barcodes:
+        barcode_map.setdefault(barcode.uom, []).append(barcode.barcode)
+
+    return {
+        "item_id": item.name,
+        "item_code": item.name,
+        "item_name": item.item_name,
+        "item_name_english": item_name_english,
+        "item_name_arabic": item_name_arabic,
+        # get_items never selected custom_tax_percentage, so terminals have always
+        # received 0.0 and apply the tax from the POS settings instead.
+        "tax_percentage": 0.0,
+        "description": item.description,
+        "disabled": item.disabled,
+        "barcodes": [
+            {
+                "id": barcode.name,
+                "barcode": barcode.barcode,
+                "uom": barcode.uom,
+            }
+            for barcode in barcodes
+        ],
+        "uom": [
+            {
+                "id": uom.name,
+                "uom": uom.uom,
+                "conversion_factor": uom.conversion_factor,
+                "price": round(prices.get(uom.uom, 0.0), 2),
+                "price_schedule": serialize_price_schedule((schedules or {}).get(uom.uom, [])),
+                "barcode": ", ".join(barcode_map.get(uom.uom, [])),
+                "editable_price": bool(
+                    uom_flags.get(uom.uom, {}).get("custom_editable_price")
+                ),
+                "editable_quantity": bool(
+                    uom_flags.get(uom.uom, {}).get("custom_editable_quantity")
+                ),
+            }
+            for uom in uoms
+        ],
+    }
+
+
+# Catalog snapshots
+# -----------------
+# The full get_items payload of a POS Profile is kept in the cache, keyed by
+# POS Profile and price list. CATALOG_SNAPSHOTS records what each snapshot was
+# built from, so document events only drop the affected ones. Dropped snapshots
+# are queued in CATALOG_WARMUP_PENDING and rebuilt in the background once the
+# changes have been quiet for WARMUP_DEBOUNCE_SECONDS.
+
+CATALOG_SNAPSHOTS = "gpos_catalog_snapshots"
+CATALOG_WARMUP_PENDING = "gpos_catalog_warmup_pending"
+CATALOG_BUILD_STATS = "gpos_catalog_build_stats"
+
+WARMUP_DEBOUNCE_SECONDS = 60
+# A continuous stream of changes still gets a rebuild after this long.
+WARMUP_MAX_DELAY_SECONDS = 600
+
+# A missing snapshot is built by one request while the others wait up to
+# SNAPSHOT_WAIT_SECONDS for it.
+SNAPSHOT_LOCK_SECONDS = 120
+SNAPSHOT_WAIT_SECONDS = 30
+
+
+def get_snapshot_key(pos_profile, price_list):
+    return f"gpos_catalog_snapshot|{pos_profile or ''}|{price_list}"
+
+
+def get_hashes_key(snapshot_key):
+    return f"{snapshot_key}|hashes"
+
+
+# Field of the shards hash holding the snapshot version the shards were cut from.
+SHARDS_VERSION_FIELD = "__snapshot__"
+
+
+def get_shards_key(snapshot_key):
+    return f"{snapshot_key}|shards"
+
+
+def get_meta_key(snapshot_key):
+    return f"{snapshot_key}|meta"
+
+
+def get_item_hash(item):
+    """
+    Content hash of one serialized item, as used in catalog manifests.
+    """
+    content = json.dumps(item, sort_keys=True, separators=(",", ":"))
+    return hashlib.md5(content.encode("utf-8")).hexdigest()[:16]
+
+
+def hash_item_group(item_group):
+    """
+    Returns (item_group_hash, {item_code: item_hash}) for one get_items item group entry.
+    """
+    item_hashes = {item["item_code"]: get_item_hash(item) for item in item_group["items"]}
+    content = json.dumps(
+        [item_group["item_group_disabled"], item_group["disabled"], sorted(item_hashes.items())],
+        separators=(",", ":"),
+    )
+    return hashlib.md5(content.encode("utf-8")).hexdigest()[:16], item_hashes
+
+
+def get_catalog_hashes(pos_profile=None):
+    """
+    Content hashes of the POS Profile catalog,
+    {item_group: {"hash": ..., "items": {item_code: hash}, "count": ..., "size": ...}}
+    where size is the length in bytes of the serialized item group.
+
+    Kept next to the snapshot under its own key so get_items does not load
+    them, and recomputed from the snapshot when its version moved on.
+    """
+    meta = get_catalog_meta(pos_profile)
+    key = get_snapshot_key(pos_profile, meta["price_list"])
+
+    hashes = frappe.cache().get_value(get_hashes_key(key))
+    if hashes and hashes["version"] == meta["version"]:
+        return hashes["item_groups"]
+
+    snapshot = get_catalog_snapshot(pos_profile)
+    return cache_catalog_groups(key, snapshot["version"], json.loads(snapshot["data"]))
+
+
+def cache_catalog_groups(key, version, item_groups):
+    """
+    Writes the hashes and shards of a snapshot's item groups next to it, both
+    tagged with the snapshot version they come from. Returns the hashes.
+    """
+    hashes = {}
+    shards = {SHARDS_VERSION_FIELD: version}
+    for item_group in item_groups:
+        data = json.dumps(item_group)
+        group_hash, item_hashes = hash_item_group(item_group)
+        hashes[item_group["item_group"]] = {
+            "hash": group_hash,
+            "items": item_hashes,
+            "count": len(item_hashes),
+            "size": len(data.encode("utf-8")),
+        }
+        shards[item_group["item_group"]] = {"version": group_hash, "snapshot": version, "data": data}
+
+    frappe.cache().set_value(get_hashes_key(key), {"version": version, "item_groups": hashes})
+    # Overwritten in place so readers never find the hash empty, then groups
+    # that left the catalog are dropped.
+    shards_key = get_shards_key(key)
+    for field, value in shards.items():
+        frappe.cache().hset(shards_key, field, value)
+    for field in frappe.cache().hkeys(shards_key):
+        field = field.decode("utf-8") if isinstance(field, bytes) else field
+        if field not in shards:
+            frappe.cache().hdel(shards_key, field)
+    return hashes
+
+
+def get_catalog_meta(pos_profile=None):
+    """
+    {"version", "cursor", "price_list", "count", "price_date"} of the catalog
+    snapshot, from a small key kept next to it so callers that only need these
+    do not load the serialized catalog. Builds the snapshot when missing.
+    """
+    key = get_snapshot_key(pos_profile, get_pos_price_list(pos_profile))
+    meta = frappe.cache().get_value(get_meta_key(key))
+    if meta and meta["price_date"] == str(getdate()):
+        return meta
+    return get_snapshot_meta(get_catalog_snapshot(pos_profile))
+
+
+def get_snapshot_meta(snapshot):
+    return {field: snapshot[field] for field in ("version", "cursor", "price_list", "count", "price_date")}
+
+
+def get_catalog_snapshot(pos_profile=None, force=False):
+    """
+    Returns the cached catalog snapshot of the POS Profile, building it when missing.
+
+    The snapshot is a dict with the serialized payload in `data`, the number of
+    item groups in `count`, a content `version` and the change log `cursor` it
+    is current up to. With `force` it is rebuilt from the database and replaces
+    the cached one. Raises frappe.DoesNotExistError for an unknown POS Profile.
+    """
+    price_list = get_pos_price_list(pos_profile)
+    key = get_snapshot_key(pos_profile, price_list)
+
+    # Prices follow Item Price validity dates, a snapshot from an earlier day is rebuilt.
+    snapshot = None if force else frappe.cache().get_value(key)
+    if snapshot and snapshot.get("price_date") == str(getdate()):
+        return snapshot
+
+    if pos_profile and not frappe.db.exists("POS Profile", pos_profile):
+        raise frappe.DoesNotExistError(f"POS Profile {pos_profile} not found")
+
+    if force:
+        return make_catalog_snapshot(pos_profile, price_list, key)
+
+    # One request builds a missing snapshot, the others wait for it instead of
+    # all building the same catalog. A waiter that runs out of time builds it itself.
+    lock_key = f"{key}|building"
+    locked = frappe.cache().set(frappe.cache().make_key(lock_key), 1, nx=True, ex=SNAPSHOT_LOCK_SECONDS)
+    if not locked:
+        deadline = time.monotonic() + SNAPSHOT_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            snapshot = frappe.cache().get_value(key, expires=True)
+            if snapshot and snapshot.get("price_date") == str(getdate()):
+                return snapshot
+
+    try:
+        return make_catalog_snapshot(pos_profile, price_list, key)
+    finally:
+        if locked:
+            frappe.cache().delete_value(lock_key)
+
+
+def make_catalog_snapshot(pos_profile, price_list, key):
+    started = time.monotonic()
+    # Taken before the build so changes made while building are replayed by the delta sync.
+    cursor = get_last_change_seq()
+    item_groups = get_pos_item_groups(pos_profile)
+    item_filters = {"item_group": ["in", item_groups]} if item_groups else {}
+    items = frappe.get_all("Item", fields=get_item_fields(), filters=item_filters)
+    result = build_grouped_items(items, price_list)
+
+    data = json.dumps(result)
+    snapshot = {
+        "pos_profile": pos_profile,
+        "price_list": price_list,
+        "version": hashlib.md5(data.encode("utf-8")).hexdigest(),
+        "built_on": str(now_datetime()),
+        "count": len(result),
+        "cursor": cursor,
+        "price_date": str(getdate()),
+        "build_seconds": round(time.monotonic() - started, 3),
+        "data": data,
+    }
+    frappe.cache().set_value(key, snapshot)
+    frappe.cache().set_value(get_meta_key(key), get_snapshot_meta(snapshot))
+    cache_catalog_groups(key, snapshot["version"], result)
+    frappe.cache().hset(
+        CATALOG_SNAPSHOTS,
+        key,
+        {"pos_profile": pos_profile, "price_list": price_list, "item_groups": item_groups},
+    )
+    frappe.cache().hset(
+        CATALOG_BUILD_STATS,
+        pos_profile or "",
+        {field: snapshot[field] for field in ("price_list", "build_seconds", "built_on", "count", "version")},
+    )
+    return snapshot
+
+
+def get_catalog_shard(pos_profile, item_group):
+    """
+    One item group of the POS Profile catalog as {"version": ..., "data": json},
+    or None when the group is not part of the catalog.
+
+    Shards are cut from the catalog snapshot when it is built and cached in a
+    hash next to it, so they always match the manifest. The version is the
+    item group hash of get_catalog_hashes.
+    """
+    meta = get_catalog_meta(pos_profile)
+    key = get_snapshot_key(pos_profile, meta["price_list"])
+    shards_key = get_shards_key(key)
+
+    shard = frappe.cache().hget(shards_key, item_group)
+    if shard and shard["snapshot"] == meta["version"]:
+        return shard
+    if not shard and frappe.cache().hget(shards_key, SHARDS_VERSION_FIELD) == meta["version"]:
+        return None
+
+    snapshot = get_catalog_snapshot(pos_profile)
+    item_groups = json.loads(snapshot["data"])
+    hashes = cache_catalog_groups(key, snapshot["version"], item_groups)
+    for group in item_groups:
+        if group["item_group"] == item_group:
+            return {"version": hashes[item_group]["hash"], "snapshot": snapshot["version"], "data": json.dumps(group)}
+    return None
+
+
+def build_catalog_snapshot(pos_profile=None, force=False):
+    get_catalog_snapshot(pos_profile, force=force)
+    frappe.enqueue(
+        "gpos.gpos.catalog_db.build_catalog_database",
+        queue="long",
+        job_id=f"gpos_catalog_db|{frappe.local.site}|{pos_profile or ''}",
+        deduplicate=True,
+        pos_profile=pos_profile,
+    )
+
+
+def mark_for_warmup(pos_profile):
+    now = time.time()
+    pending = frappe.cache().hget(CATALOG_WARMUP_PENDING, pos_profile or "")
+    frappe.cache().hset(
+        CATALOG_WARMUP_PENDING,
+        pos_profile or "",
+        {"first": pending["first"] if pending else now, "last": now},
+    )
+
+
+def queue_daily_catalog_warmup():
+    """
+    Scheduled daily. Queues every known snapshot for a rebuild with the prices of the new day.
+    """
+    snapshots = frappe.cache().hgetall(CATALOG_SNAPSHOTS) or {}
+    for pos_profile in {meta.get("pos_profile") for meta in snapshots.values()}:
+        mark_for_warmup(pos_profile)
+
+
+def warm_catalog_snapshots():
+    """
+    Scheduled every minute. Enqueues a rebuild for each POS Profile whose
+    catalog changes have settled, one job per profile so they run in parallel
+    on the long queue workers.
+    """
+    now = time.time()
+    pending = frappe.cache().hgetall(CATALOG_WARMUP_PENDING) or {}
+
+    for pos_profile, changed in pending.items():
+        if isinstance(pos_profile, bytes):
+            pos_profile = pos_profile.decode("utf-8")
+        if (
+            now - changed["last"] < WARMUP_DEBOUNCE_SECONDS
+            and now - changed["first"] < WARMUP_MAX_DELAY_SECONDS
+        ):
+            continue
+
+        frappe.cache().hdel(CATALOG_WARMUP_PENDING, pos_profile)
+        frappe.enqueue(
+            "gpos.gpos.catalog.build_catalog_snapshot",
+            queue="long",
+            job_id=f"gpos_catalog_warmup|{frappe.local.site}|{pos_profile}",
+            deduplicate=True,
+            pos_profile=pos_profile or None,
+            # A snapshot a request rebuilt in the meantime may still predate the changes.
+            force=True,
+        )
+
+
+@frappe.whitelist()
+def get_catalog_build_stats():
+    """
+    Last snapshot build of each POS Profile with its duration in seconds.
+    """
+    stats = frappe.cache().hgetall(CATALOG_BUILD_STATS) or {}
+    return {
+        (pos_profile.decode("utf-8") if isinstance(pos_profile, bytes) else pos_profile): build
+        for pos_profile, build in stats.items()
+    }
+
+
+def invalidate_catalog_snapshots(price_list=None, item_groups=None, pos_profile=None):
+    """
+    Drops the snapshots built from the given price list, item groups or POS Profile.
+    Called without arguments it drops every snapshot.
+    """
+    snapshots = frappe.cache().hgetall(CATALOG_SNAPSHOTS) or {}
+    everything = not (price_list or item_groups or pos_profile)
+    item_groups = set(item_groups or [])
+
+    for key, meta in snapshots.items():
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        if not (
+            everything
+            or (price_list and meta.get("price_list") == price_list)
+            or (pos_profile and meta.get("pos_profile") == pos_profile)
+            or (item_groups and (not meta.get("item_groups") or item_groups & set(meta["item_groups"])))
+        ):
+            continue
+        # The CATALOG_SNAPSHOTS entry is kept so later changes keep pushing the warm-up back.
+        frappe.cache().delete_value([key, get_meta_key(key), get_hashes_key(key), get_shards_key(key)])
+        mark_for_warmup(meta.get("pos_profile"))
+
+
+# The hooks below drop snapshots after commit. Dropped before, a concurrent
+# request could rebuild from the rows of the open transaction's snapshot and
+# cache the old catalog until the next change.
+
+
+def on_item_change(doc, method=None):
+    # Item Barcode and UOM Conversion Detail are child tables of Item,
+    # their changes arrive here through the parent Item save.
+    item_groups = {doc.item_group}
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before:
+        item_groups.add(before.item_group)
+    frappe.db.after_commit.add(partial(invalidate_catalog_snapshots, item_groups=item_groups))
+
+
+def on_item_price_change(doc, method=None):
+    price_lists = {doc.price_list}
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before:
+        price_lists.add(before.price_list)
+    for price_list in price_lists:
+        frappe.db.after_commit.add(partial(invalidate_catalog_snapshots, price_list=price_list))
+
+
+def on_item_group_change(doc, method=None):
+    # Moving a group changes the subtree of its old and new parents as well.
+    item_groups = {doc.name, doc.parent_item_group}
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before:
+        item_groups.add(before.parent_item_group)
+
+    def invalidate():
+        frappe.cache().delete_value(ITEM_GROUP_SUBTREES)
+        invalidate_catalog_snapshots(item_groups=[name for name in item_groups if name])
+
+    frappe.db.after_commit.add(invalidate)
+
+
+def on_uom_change(doc, method=None):
+    # Editable flags of a UOM can appear in any catalog.
+    frappe.db.after_commit.add(invalidate_catalog_snapshots)
+
+
+def on_pos_profile_change(doc, method=None):
+    frappe.db.after_commit.add(partial(invalidate_pos_profile, doc.name, method == "on_trash"))
+
+
+def invalidate_pos_profile(pos_profile, trashed=False):
+    invalidate_catalog_snapshots(pos_profile=pos_profile)
+
+    # The profile's price list or item groups may have changed, the next build registers it again.
+    snapshots = frappe.cache().hgetall(CATALOG_SNAPSHOTS) or {}
+    for key, meta in snapshots.items():
+        if meta.get("pos_profile") == pos_profile:
+            frappe.cache().hdel(CATALOG_SNAPSHOTS, key.decode("utf-8") if isinstance(key, bytes) else key)
+    if trashed:
+        frappe.cache().hdel(CATALOG_WARMUP_PENDING, pos_profile)
@@ -0,0 +1,364 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import frappe
+from frappe.utils import cint, flt, now_datetime, today
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+from gpos.gpos.catalog import get_catalog_snapshot
+
+# A ready to use SQLite copy of a POS Profile catalog for offline terminals.
+# Files are named after their content version and only written when the
+# contents change. A .json sidecar per POS Profile points at the current file
+# with its checksum and size, and is replaced in one rename once the new file
+# is complete. The previous file is kept for downloads still in progress.
+
+CATALOG_DB_SCHEMA_VERSION = 2
+
+CATALOG_DB_SCHEMA = """
+create table meta (key text primary key, value text);
+create table item_groups (item_group text primary key, disabled integer);
+create table items (
+    item_code text primary key,
+    item_group text,
+    item_name text,
+    item_name_english text,
+    item_name_arabic text,
+    description text,
+    tax_percentage real,
+    disabled integer
+);
+create table uoms (
+    id text primary key,
+    item_code text not null,
+    uom text not null,
+    conversion_factor real,
+    price real,
+    editable_price integer,
+    editable_quantity integer
+);
+create table price_schedule (item_code text not null, uom text not null, valid_from text not null, price real);
+create table barcodes (id text primary key, barcode text not null, item_code text not null, uom text);
+create table promotions (id text primary key, company text, valid_from text, valid_upto text);
+create table promotion_items (
+    id text primary key,
+    promotion text not null,
+    item_code text,
+    item_name text,
+    uom text,
+    discount_type text,
+    min_qty integer,
+    max_qty integer,
+    discount_percentage real,
+    discount_price real,
+    sale_price real,
+    price_after_discount real
+);
+create table customers (
+    id text primary key,
+    customer_name text,
+    phone_no text,
+    vat_number text,
+    customer_group text,
+    disabled integer
+);
+create index items_item_group on items (item_group);
+create index uoms_item_code on uoms (item_code);
+create index price_schedule_item_code on price_schedule (item_code, uom, valid_from);
+create index barcodes_barcode on barcodes (barcode);
+create index barcodes_item_code on barcodes (item_code);
+create index promotion_items_item_code on promotion_items (item_code);
+create index customers_phone_no on customers (phone_no);
+"""
+
+
+def get_catalog_db_dir():
+    return frappe.get_site_path("private", "gpos_catalog")
+
+
+def get_catalog_db_prefix(pos_profile=None):
+    return "catalog-" + hashlib.md5((pos_profile or "").encode("utf-8")).hexdigest()[:12]
+
+
+def get_catalog_db_info(pos_profile=None):
+    path = os.path.join(get_catalog_db_dir(), get_catalog_db_prefix(pos_profile) + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def get_catalog_db_rows(pos_profile=None):
+    """
+    {table: [row tuples]} for the catalog database of a POS Profile. Items,
+    UOMs, prices and barcodes come from the catalog snapshot so they match get_items.
+    """
+    snapshot = get_catalog_snapshot(pos_profile)
+    rows = {
+        "item_groups": [],
+        "items": [],
+        "uoms": [],
+        "price_schedule": [],
+        "barcodes": [],
+        "promotions": [],
+        "promotion_items": [],
+        "customers": [],
+    }
+
+    for item_group in json.loads(snapshot["data"]):
+        rows["item_groups"].append((item_group["item_group"], cint(item_group["item_group_disabled"])))
+        for item in item_group["items"]:
+            rows["items"].append(
+                (
+                    item["item_code"],
+                    item_group["item_group"],
+                    item["item_name"],
+                    item["item_name_english"],
+                    item["item_name_arabic"],
+                    item["description"],
+                    flt(item["tax_percentage"]),
+                    cint(item["disabled"]),
+                )
+            )
+            for uom in item["uom"]:
+                rows["uoms"].append(
+                    (
+                        uom["id"],
+                        item["item_code"],
+                        uom["uom"],
+                        uom["conversion_factor"],
+                        uom["price"],
+                        cint(uom["editable_price"]),
+                        cint(uom["editable_quantity"]),
+                    )
+                )
+                for change in uom["price_schedule"]:
+                    rows["price_schedule"].append((item["item_code"], uom["uom"], change["from"], change["price"]))
+            for barcode in item["barcodes"]:
+                rows["barcodes"].append((barcode["id"], barcode["barcode"], item["item_code"], barcode["uom"]))
+
+    if pos_profile:
+        promotions = frappe.get_all(
+            "promotion",
+            filters={
+                "name": [
+                    "in",
+                    frappe.get_all(
+                        "pos profile child table",
+                        filters={"parenttype": "promotion", "pos_profile": pos_profile},
+                        pluck="parent",
+                    ) or [""],
+                ],
+                "valid_upto": [">=", today()],
+                "docstatus": 1,
+                "enabled": 1,
+            },
+            fields=["name", "company", "valid_from", "valid_upto"],
+            order_by="name",
+        )
+        rows["promotions"] = [
+            (promo.name, promo.company, str(promo.valid_from), str(promo.valid_upto)) for promo in promotions
+        ]
+        if promotions:
+            for item in frappe.get_all(
+                "Item child table",
+                filters={"parenttype": "promotion", "parent": ["in", [promo.name for promo in promotions]]},
+                fields=[
+                    "name", "parent", "item_code", "item_name", "uom", "discount_type", "min_qty", "max_qty",
+                    "discount_percentage", "discount__amount", "sale_price", "price_after_discount",
+                ],
+                order_by="name",
+            ):
+                rows["promotion_items"].append(
+                    (
+                        item.name,
+                        item.parent,
+                        item.item_code,
+                        item.item_name,
+                        item.uom,
+                        item.discount_type,
+                        item.min_qty,
+                        item.max_qty,
+                        item.discount_percentage,
+                        item.discount__amount,
+                        flt(item.sale_price),
+                        flt(item.price_after_discount),
+                    )
+                )
+
+        customer_filters = {
+            "name": [
+                "in",
+                frappe.get_all(
+                    "pos profile child table",
+                    filters={"parenttype": "Customer", "pos_profile": pos_profile},
+                    pluck="parent",
+                ) or [""],
+            ]
+        }
+    else:
+        customer_filters = {}
+
+    rows["customers"] = [
+        (customer.name, customer.customer_name, customer.mobile_no, customer.tax_id, customer.customer_group, customer.disabled)
+        for customer in frappe.get_all(
+            "Customer",
+            filters=customer_filters,
+            fields=["name", "customer_name", "mobile_no", "tax_id", "customer_group", "disabled"],
+            order_by="name",
+        )
+    ]
+
+    return snapshot, rows
+
+
+def build_catalog_database(pos_profile=None):
+    """
+    Writes the SQLite catalog of the POS Profile when its contents changed.
+    Returns the sidecar info of the current file.
+    """
+    snapshot, rows = get_catalog_db_rows(pos_profile)
+    content = json.dumps([CATALOG_DB_SCHEMA_VERSION, snapshot["price_list"], rows], default=str)
+    version = hashlib.md5(content.encode("utf-8")).hexdigest()
+
+    info = get_catalog_db_info(pos_profile)
+    if info and info["version"] == version:
+        return info
+
+    directory = get_catalog_db_dir()
+    prefix = get_catalog_db_prefix(pos_profile)
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"{prefix}-{version}.sqlite"
+    path = os.path.join(directory, file_name)
+    tmp_path = f"{path}.{frappe.generate_hash(length=8)}.tmp"
+
+    try:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.executescript(CATALOG_DB_SCHEMA)
+            for table, table_rows in rows.items():
+                if table_rows:
+                    placeholders = ", ".join("?" * len(table_rows[0]))
+                    connection.executemany(f"insert into {table} values ({placeholders})", table_rows)
+            connection.executemany(
+                "insert into meta values (?, ?)",
+                [
+                    ("schema_version", str(CATALOG_DB_SCHEMA_VERSION)),
+                    ("version", version),
+                    ("pos_profile", pos_profile or ""),
+                    ("price_list", snapshot["price_list"]),
+                    ("cursor", str(snapshot["cursor"])),
+                    ("built_on", str(now_datetime())),
+                ],
+            )
+            connection.commit()
+            connection.execute("vacuum")
+        finally:
+            connection.close()
+
+        sha256 = hashlib.sha256()
+        with open(tmp_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+
+        previous = info
+        info = {
+            "pos_profile": pos_profile,
+            "file": file_name,
+            "version": version,
+            "schema_version": CATALOG_DB_SCHEMA_VERSION,
+            "sha256": sha256.hexdigest(),
+            "size": os.path.getsize(tmp_path),
+            "cursor": snapshot["cursor"],
+            "built_on": str(now_datetime()),
+        }
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    info_path = os.path.join(directory, prefix + ".json")
+    with open(info_path + ".tmp", "w") as f:
+        json.dump(info, f)
+    os.replace(info_path + ".tmp", info_path)
+
+    keep = {file_name, previous["file"] if previous else None}
+    for name in os.listdir(directory):
+        if name.startswith(prefix + "-") and name.endswith(".sqlite") and name not in keep:
+            os.remove(os.path.join(directory, name))
+    return info
+
+
+def build_catalog_databases():
+    """
+    Scheduled hourly. Promotions and customers do not invalidate the catalog
+    snapshot, this picks up their changes.
+    """
+    for pos_profile in frappe.get_all("POS Profile", filters={"disabled": 0}, pluck="name"):
+        enqueue_catalog_database(pos_profile)
+
+
+def enqueue_catalog_database(pos_profile=None):
+    frappe.enqueue(
+        "gpos.gpos.catalog_db.build_catalog_database",
+        queue="long",
+        job_id=f"gpos_catalog_db|{frappe.local.site}|{pos_profile or ''}",
+        deduplicate=True,
+        pos_profile=pos_profile,
+    )
+
+
+@frappe.whitelist()
+def get_catalog_database_info(pos_profile=None):
+    """
+    Version, sha256 checksum and size of the prebuilt catalog database.
+    """
+    info = get_catalog_db_info(pos_profile)
+    if not info:
+        enqueue_catalog_database(pos_profile)
+        return Response(
+            json.dumps({"error": "Catalog database is being built, retry later"}),
+            status=404,
+            mimetype="application/json",
+        )
+    return Response(json.dumps({"data": info}), status=200, mimetype="application/json")
+
+
+@frappe.whitelist()
+def download_catalog_database(pos_profile=None, version=None):
+    """
+    The prebuilt SQLite catalog of the POS Profile. It carries the customers
+    of the profile, so like customer_list it needs a login. Terminals verify the
+    X-Catalog-SHA256 header, then swap the file in. Returns 304 when `version`
+    is already current.
+    """
+    info = get_catalog_db_info(pos_profile)
+    if not info:
+        enqueue_catalog_database(pos_profile)
+        return Response(
+            json.dumps({"error": "Catalog database is being built, retry later"}),
+            status=404,
+            mimetype="application/json",
+        )
+
+    headers = {
+        "ETag": info["version"],
+        "X-Catalog-Version": info["version"],
+        "X-Catalog-SHA256": info["sha256"],
+    }
+    if version and version == info["version"]:
+        return Response(status=304, headers=headers)
+
+    f = open(os.path.join(get_catalog_db_dir(), info["file"]), "rb")
+    headers["Content-Length"] = str(os.fstat(f.fileno()).st_size)
+    headers["Content-Disposition"] = 'attachment; filename="catalog.sqlite"'
+    return Response(
+        wrap_file(frappe.local.request.environ, f),
+        status=200,
+        mimetype="application/vnd.sqlite3",
+        headers=headers,
+        direct_passthrough=True,
+    )
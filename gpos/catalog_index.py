@@ -0,0 +1,462 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from functools import partial
+
+import frappe
+from frappe.utils import getdate
+
+# A read-only catalog index file shared by all workers of a host through mmap.
+# It holds items, barcodes and the prices of the POS Profile price lists as
+# fixed-width records sorted by key, with their strings in one pool, so a
+# lookup is a binary search over the mapped file and workers do not keep one
+# Python object per item.
+#
+# The file is built by one background job. Item and Item Price changes add
+# their item codes to CATALOG_INDEX_DIRTY after commit and queue a rebuild.
+# Until the rebuilt file is published, lookups keep using the current file and
+# read only the dirty items from the database. Workers map the newly published
+# file on their next lookup. A file built on an earlier day is not used, lookups
+# fall back to the per-worker barcode index and price matrix until the daily
+# rebuild is published.
+
+CATALOG_INDEX_FILE = "gpos_catalog_index_file"
+CATALOG_INDEX_BUILDING = "gpos_catalog_index_building"
+# Sorted set of item codes scored by the time they changed.
+CATALOG_INDEX_DIRTY = "gpos_catalog_index_dirty"
+# Changes are kept dirty this long before a build start, for clock skew between hosts.
+CATALOG_INDEX_DIRTY_MARGIN_SECONDS = 5
+
+MAGIC = b"GPOSIDX1"
+HEADER_LENGTH = struct.Struct("<I")
+
+# code, item_name and stock_uom as (offset, length) into the string pool, disabled.
+ITEM = struct.Struct("<IHIHIHB")
+# barcode, item position, uom, conversion_factor, editable_price, editable_quantity.
+BARCODE = struct.Struct("<IHIIHdBB")
+# price list position, item position, uom, price_list_rate.
+PRICE = struct.Struct("<HIIHd")
+
+_catalog_indexes = {}
+
+
+class StringPool:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, value):
+        value = (value or "").encode("utf-8")
+        if len(value) > 0xFFFF:
+            # Clipped to the 16 bit length field at a character boundary.
+            value = value[:0xFFFF].decode("utf-8", "ignore").encode("utf-8")
+        if value not in self.offsets:
+            self.offsets[value] = len(self.data)
+            self.data += value
+        return self.offsets[value], len(value)
+
+
+def write_catalog_index(path, stamp, date, items, barcode_index, matrices):
+    """
+    Writes the index file from Item rows, a barcode index as built by
+    barcode.build_barcode_index and {price_list: price matrix}.
+    """
+    pool = StringPool()
+    items = sorted(items, key=lambda item: item.name.encode("utf-8"))
+    positions = {item.name: position for position, item in enumerate(items)}
+
+    item_records = bytearray()
+    for item in items:
+        item_records += ITEM.pack(
+            *pool.add(item.name), *pool.add(item.item_name), *pool.add(item.stock_uom), 1 if item.disabled else 0
+        )
+
+    barcode_records = bytearray()
+    barcode_count = 0
+    for barcode in sorted(barcode_index, key=lambda barcode: barcode.encode("utf-8")):
+        item_code, _, uom, conversion_factor, editable_price, editable_quantity = barcode_index[barcode]
+        if item_code not in positions:
+            continue
+        barcode_records += BARCODE.pack(
+            *pool.add(barcode),
+            positions[item_code],
+            *pool.add(uom),
+            conversion_factor or 1.0,
+            1 if editable_price else 0,
+            1 if editable_quantity else 0,
+        )
+        barcode_count += 1
+
+    price_lists = sorted(matrices)
+    price_rows = []
+    for price_list_position, price_list in enumerate(price_lists):
+        for item_code, prices in matrices[price_list].items():
+            if item_code not in positions:
+                continue
+            for uom, rate in prices.items():
+                price_rows.append((price_list_position, positions[item_code], (uom or "").encode("utf-8"), uom, rate))
+    price_rows.sort(key=lambda row: row[:3])
+    price_records = bytearray()
+    for price_list_position, item_position, _, uom, rate in price_rows:
+        price_records += PRICE.pack(price_list_position, item_position, *pool.add(uom), rate or 0.0)
+
+    sections = {}
+    offset = 0
+    for name, data, count in (
+        ("items", item_records, len(items)),
+        ("barcodes", barcode_records, barcode_count),
+        ("prices", price_records, len(price_rows)),
+        ("strings", pool.data, len(pool.data)),
+    ):
+        sections[name] = {"offset": offset, "count": count}
+        offset += len(data)
+
+    header = json.dumps(
+        {"stamp": stamp, "date": str(date), "price_lists": price_lists, "sections": sections}
+    ).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for data in (item_records, barcode_records, price_records, pool.data):
+            f.write(data)
+
+
+class CatalogIndex:
+    """
+    Lookups over a mapped index file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog index")
+
+        header_length = HEADER_LENGTH.unpack_from(self.map, len(MAGIC))[0]
+        start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(self.map[start : start + header_length])
+        start += header_length
+
+        self.stamp = header["stamp"]
+        self.date = header["date"]
+        self.price_lists = {price_list: position for position, price_list in enumerate(header["price_lists"])}
+        self.sections = {
+            name: (start + section["offset"], section["count"]) for name, section in header["sections"].items()
+        }
+        self.strings = self.sections["strings"][0]
+
+    def string(self, offset, length):
+        start = self.strings + offset
+        return self.map[start : start + length]
+
+    def record(self, section, record, position):
+        start, _ = self.sections[section]
+        return record.unpack_from(self.map, start + position * record.size)
+
+    def search(self, section, record, key):
+        """
+        Position of the record whose leading string equals `key`, or None.
+        """
+        key = key.encode("utf-8")
+        low, high = 0, self.sections[section][1]
+        while low < high:
+            middle = (low + high) // 2
+            fields = self.record(section, record, middle)
+            value = self.string(fields[0], fields[1])
+            if value < key:
+                low = middle + 1
+            elif value > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def find_item(self, item_code):
+        return self.search("items", ITEM, item_code or "")
+
+    def item_exists(self, item_code):
+        return self.find_item(item_code) is not None
+
+    def get_barcodes(self):
+        return BarcodeLookup(self, get_dirty_item_codes())
+
+    def get_item(self, position):
+        """
+        (item_code, item_name, stock_uom, disabled) of the item at `position`.
+        """
+        fields = self.record("items", ITEM, position)
+        return (
+            self.string(fields[0], fields[1]).decode("utf-8"),
+            self.string(fields[2], fields[3]).decode("utf-8"),
+            self.string(fields[4], fields[5]).decode("utf-8"),
+            bool(fields[6]),
+        )
+
+    def has_price_list(self, price_list):
+        return price_list in self.price_lists
+
+    def get_prices(self, price_list):
+        return PriceLookup(self, price_list, get_dirty_item_codes())
+
+    def get_item_prices(self, price_list_position, item_position):
+        """
+        {uom: price_list_rate} of one item, read from its run of price records.
+        """
+        low, high = 0, self.sections["prices"][1]
+        while low < high:
+            middle = (low + high) // 2
+            if self.record("prices", PRICE, middle)[:2] < (price_list_position, item_position):
+                low = middle + 1
+            else:
+                high = middle
+
+        prices = {}
+        while low < self.sections["prices"][1]:
+            fields = self.record("prices", PRICE, low)
+            if fields[:2] != (price_list_position, item_position):
+                break
+            prices[self.string(fields[2], fields[3]).decode("utf-8")] = fields[4]
+            low += 1
+        return prices
+
+
+class BarcodeLookup:
+    """
+    Reads like the barcode index dict, {barcode: (item_code, item_name, uom,
+    conversion_factor, editable_price, editable_quantity)}.
+
+    While items are dirty, barcodes of dirty items and barcodes the file does
+    not have are read from the database.
+    """
+
+    def __init__(self, index, dirty):
+        self.index = index
+        self.dirty = dirty
+        self.loaded = {}
+
+    def get(self, barcode, default=None):
+        entry = self.read(barcode)
+        if self.dirty and (entry is None or entry[0] in self.dirty):
+            entry = self.load(barcode)
+        return default if entry is None else entry
+
+    def read(self, barcode):
+        position = self.index.search("barcodes", BARCODE, barcode or "")
+        if position is None:
+            return None
+        fields = self.index.record("barcodes", BARCODE, position)
+        item_code, item_name, _, _ = self.index.get_item(fields[2])
+        return (
+            item_code,
+            item_name,
+            self.index.string(fields[3], fields[4]).decode("utf-8"),
+            fields[5],
+            bool(fields[6]),
+            bool(fields[7]),
+        )
+
+    def load(self, barcode):
+        from gpos.gpos.barcode import build_barcode_index
+
+        if barcode not in self.loaded:
+            self.loaded[barcode] = build_barcode_index([barcode]).get(barcode) if barcode else None
+        return self.loaded[barcode]
+
+    def __contains__(self, barcode):
+        return self.get(barcode) is not None
+
+    def __getitem__(self, barcode):
+        entry = self.get(barcode)
+        if entry is None:
+            raise KeyError(barcode)
+        return entry
+
+
+class PriceLookup:
+    """
+    Reads like a price matrix, {item_code: {uom: price_list_rate}}. Prices of
+    dirty items are read from the database.
+    """
+
+    def __init__(self, index, price_list, dirty):
+        self.index = index
+        self.price_list = price_list
+        self.price_list_position = index.price_lists[price_list]
+        self.dirty = dirty
+        self.loaded = {}
+
+    def get(self, item_code, default=None):
+        if item_code in self.dirty:
+            if item_code not in self.loaded:
+                self.loaded[item_code] = self.load(item_code)
+            return self.loaded[item_code] or default
+        item_position = self.index.find_item(item_code)
+        if item_position is None:
+            return default
+        return self.index.get_item_prices(self.price_list_position, item_position) or default
+
+    def load(self, item_code):
+        from gpos.gpos.price_matrix import get_item_prices_by_uom, get_price_timeline
+
+        prices = {}
+        date = getdate()
+        for (_, uom), item_prices in get_item_prices_by_uom(
+            {"item_code": item_code, "price_list": self.price_list}
+        ).items():
+            rate = get_price_timeline(item_prices, date)[0]
+            if rate is not None:
+                prices[uom] = rate
+        return prices
+
+    def __contains__(self, item_code):
+        return self.get(item_code) is not None
+
+    def __getitem__(self, item_code):
+        prices = self.get(item_code)
+        if prices is None:
+            raise KeyError(item_code)
+        return prices
+
+
+def get_dirty_item_codes():
+    """
+    Item codes changed since the published index file was built.
+    """
+    return {
+        item_code.decode("utf-8") if isinstance(item_code, bytes) else item_code
+        for item_code in frappe.cache().zrange(frappe.cache().make_key(CATALOG_INDEX_DIRTY), 0, -1)
+    }
+
+
+def mark_catalog_index_dirty(item_codes):
+    item_codes = {item_code for item_code in item_codes if item_code}
+    if not item_codes:
+        return
+    now = time.time()
+    frappe.cache().zadd(
+        frappe.cache().make_key(CATALOG_INDEX_DIRTY), {item_code: now for item_code in item_codes}
+    )
+    enqueue_catalog_index_build()
+
+
+def get_catalog_index_dir():
+    return frappe.get_site_path("private", "gpos_index")
+
+
+def build_catalog_index():
+    """
+    Background job writing a new index file and publishing it to the workers.
+    """
+    from gpos.gpos.barcode import build_barcode_index
+    from gpos.gpos.price_matrix import DEFAULT_PRICE_LIST, get_pos_price_list, load_price_matrix
+
+    # Changes marked after this stay dirty, the build may have read them or not.
+    started = time.time() - CATALOG_INDEX_DIRTY_MARGIN_SECONDS
+    stamp = frappe.generate_hash(length=10)
+    date = getdate()
+
+    price_lists = {DEFAULT_PRICE_LIST}
+    for pos_profile in frappe.get_all("POS Profile", filters={"disabled": 0}, pluck="name"):
+        price_lists.add(get_pos_price_list(pos_profile))
+
+    directory = get_catalog_index_dir()
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"catalog-{hashlib.md5(f'{stamp}|{date}'.encode('utf-8')).hexdigest()[:12]}.idx"
+    path = os.path.join(directory, file_name)
+    tmp_path = f"{path}.{frappe.generate_hash(length=8)}.tmp"
+
+    try:
+        write_catalog_index(
+            tmp_path,
+            stamp,
+            date,
+            frappe.get_all("Item", fields=["name", "item_name", "stock_uom", "disabled"]),
+            build_barcode_index(),
+            {price_list: load_price_matrix(price_list, date)[0] for price_list in price_lists},
+        )
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    previous = frappe.cache().get_value(CATALOG_INDEX_FILE)
+    frappe.cache().set_value(CATALOG_INDEX_FILE, {"file": file_name, "stamp": stamp, "date": str(date)})
+    dirty_key = frappe.cache().make_key(CATALOG_INDEX_DIRTY)
+    frappe.cache().zremrangebyscore(dirty_key, "-inf", started)
+    frappe.cache().delete_value(CATALOG_INDEX_BUILDING)
+    if frappe.cache().zcard(dirty_key):
+        enqueue_catalog_index_build()
+
+    # Workers still mapping the previous file keep it open until they switch.
+    keep = {file_name, previous["file"] if previous else None}
+    for name in os.listdir(directory):
+        if name.startswith("catalog-") and name.endswith(".idx") and name not in keep:
+            os.remove(os.path.join(directory, name))
+
+
+def enqueue_catalog_index_build():
+    if frappe.cache().get_value(CATALOG_INDEX_BUILDING):
+        return
+    frappe.cache().set_value(CATALOG_INDEX_BUILDING, 1, expires_in_sec=300)
+    frappe.enqueue(
+        "gpos.gpos.catalog_index.build_catalog_index",
+        queue="long",
+        job_id=f"gpos_catalog_index|{frappe.local.site}",
+        deduplicate=True,
+    )
+
+
+def get_catalog_index():
+    """
+    The mapped index published last, or None after queueing a rebuild when
+    there is none for today.
+    """
+    published = frappe.cache().get_value(CATALOG_INDEX_FILE)
+    if not published or published["date"] != str(getdate()):
+        enqueue_catalog_index_build()
+        return None
+
+    cached = _catalog_indexes.get(frappe.local.site)
+    if cached and cached[0] == published["file"]:
+        return cached[1]
+
+    path = os.path.join(get_catalog_index_dir(), published["file"])
+    if not os.path.exists(path):
+        # Published by a worker on another host.
+        return None
+
+    index = CatalogIndex(path)
+    _catalog_indexes[frappe.local.site] = (published["file"], index)
+    return index
+
+
+def get_existing_item_codes(item_codes):
+    """
+    The subset of `item_codes` that are Items.
+    """
+    item_codes = {item_code for item_code in item_codes if item_code}
+    index = get_catalog_index()
+    if index:
+        dirty = get_dirty_item_codes()
+        existing = {item_code for item_code in item_codes - dirty if index.item_exists(item_code)}
+        item_codes &= dirty
+    else:
+        existing = set()
+    if not item_codes:
+        return existing
+    return existing | set(frappe.get_all("Item", filters={"name": ["in", list(item_codes)]}, pluck="name"))
+
+
+def on_catalog_change(doc, method=None):
+    item_codes = {doc.name} if doc.doctype == "Item" else {doc.item_code}
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before and doc.doctype == "Item Price":
+        item_codes.add(before.item_code)
+    # After commit, or a build starting in between could read the old rows and
+    # clear the dirty mark.
+    frappe.db.after_commit.add(partial(mark_catalog_index_dirty, item_codes))
@@ -0,0 +1,412 @@
+import json
+import time
+
+import frappe
+from frappe.realtime import get_website_room
+from frappe.utils import add_days, cint, now_datetime
+from werkzeug.wrappers import Response
+
+from gpos.gpos.catalog import (
+    CHANGE_LOG,
+    build_grouped_items,
+    get_catalog_hashes,
+    get_catalog_meta,
+    get_item_fields,
+    get_last_change_seq,
+    get_pos_item_groups,
+    get_pos_price_list,
+    get_pos_profile_changes,
+    hash_item_group,
+)
+
+CHANGE_LOG_RETENTION_DAYS = 30
+CHANGE_LOG_PRUNED_UPTO = "gpos_catalog_change_log_pruned_upto"
+
+# Change log names are allocated at insert, a transaction that commits late can
+# make a lower name visible after a terminal moved past it. Terminals sync on
+# `seq` instead, given to committed entries one sequencer at a time.
+CHANGE_LOG_SEQUENCE_LOCK = "gpos_catalog_change_log_sequence_lock"
+CHANGE_LOG_SEQUENCE_LOCK_SECONDS = 30
+CHANGE_LOG_SEQUENCE_WAIT_SECONDS = 5
+
+# Published to the website room, which guest terminals join as well, with the
+# POS Profile in the message for terminals to pick theirs. Item and Item Price
+# saves only collect what they touched, one event per affected POS Profile is
+# published once the transaction commits, so a bulk import sends one per
+# profile instead of one per save and profile.
+CATALOG_CHANGE_EVENT = "gpos_catalog_change"
+
+ITEM_CHILD_TABLES = (("barcodes", "Item Barcode"), ("uoms", "UOM Conversion Detail"))
+
+
+def add_change(change_type, reference_doctype, reference_name, item_code=None, uom=None, price_list=None):
+    frappe.get_doc(
+        {
+            "doctype": CHANGE_LOG,
+            "change_type": change_type,
+            "reference_doctype": reference_doctype,
+            "reference_name": reference_name,
+            "item_code": item_code,
+            "uom": uom,
+            "price_list": price_list,
+        }
+    ).insert(ignore_permissions=True)
+    queue_change_sequencing()
+
+
+def queue_change_sequencing():
+    if frappe.flags.gpos_sequence_catalog_changes:
+        return
+    frappe.flags.gpos_sequence_catalog_changes = True
+    frappe.db.after_commit.add(sequence_catalog_changes)
+    frappe.db.after_rollback.add(reset_change_sequencing)
+
+
+def reset_change_sequencing():
+    frappe.flags.gpos_sequence_catalog_changes = False
+
+
+def sequence_catalog_changes():
+    """
+    Gives the committed Catalog Change Log entries without a sequence the next
+    ones, in name order. Runs after each commit that logged changes and every
+    minute for entries whose sequencer could not take the lock.
+    """
+    reset_change_sequencing()
+    lock = frappe.cache().make_key(CHANGE_LOG_SEQUENCE_LOCK)
+    deadline = time.monotonic() + CHANGE_LOG_SEQUENCE_WAIT_SECONDS
+    while not frappe.cache().set(lock, 1, nx=True, ex=CHANGE_LOG_SEQUENCE_LOCK_SECONDS):
+        if time.monotonic() > deadline:
+            return
+        time.sleep(0.05)
+
+    try:
+        # A plain read only sees committed entries and does not wait on the row
+        # locks of transactions still inserting theirs.
+        names = frappe.db.sql(
+            f"select name from `tab{CHANGE_LOG}` where seq is null order by name",
+            pluck=True,
+        )
+        if not names:
+            return
+        frappe.db.sql(f"set @seq = (select coalesce(max(seq), 0) from `tab{CHANGE_LOG}`)")
+        frappe.db.sql(
+            f"update `tab{CHANGE_LOG}` set seq = (@seq := @seq + 1) where name in %(names)s order by name",
+            {"names": names},
+        )
+        frappe.db.commit()
+    finally:
+        frappe.cache().delete_value(CHANGE_LOG_SEQUENCE_LOCK)
+
+
+def publish_catalog_change(pos_profiles, change, after_commit=True):
+    """
+    Notifies the terminals of the POS Profiles, once the transaction commits
+    unless `after_commit` is off. The envelope only says what changed,
+    terminals pull the delta with get_catalog_changes.
+    """
+    cursor = get_last_change_seq()
+    for pos_profile in pos_profiles:
+        frappe.publish_realtime(
+            CATALOG_CHANGE_EVENT,
+            {**change, "pos_profile": pos_profile, "cursor": cursor},
+            room=get_website_room(),
+            after_commit=after_commit,
+        )
+
+
+def log_item_change(doc, method=None):
+    item_groups = {doc.item_group}
+
+    if method == "on_trash":
+        add_change("Delete", "Item", doc.name, item_code=doc.name)
+    else:
+        add_change("Upsert", "Item", doc.name, item_code=doc.name)
+
+        # Added and edited child rows travel with the item upsert, only removals need their own entry.
+        before = doc.get_doc_before_save()
+        if before:
+            item_groups.add(before.item_group)
+            for table, doctype in ITEM_CHILD_TABLES:
+                current = {row.name for row in doc.get(table)}
+                for row in before.get(table):
+                    if row.name not in current:
+                        add_change("Delete", doctype, row.name, item_code=doc.name, uom=row.uom)
+
+    queue_catalog_notification("item_group", item_groups)
+
+
+def log_item_price_change(doc, method=None):
+    price_lists = {doc.price_list}
+
+    if method == "on_trash":
+        add_change("Delete", "Item Price", doc.name, doc.item_code, doc.uom, doc.price_list)
+    else:
+        before = doc.get_doc_before_save()
+        if before and (before.item_code, before.uom, before.price_list) != (doc.item_code, doc.uom, doc.price_list):
+            price_lists.add(before.price_list)
+            add_change("Delete", "Item Price", doc.name, before.item_code, before.uom, before.price_list)
+        add_change("Upsert", "Item Price", doc.name, doc.item_code, doc.uom, doc.price_list)
+
+    queue_catalog_notification("price_list", price_lists)
+
+
+def queue_catalog_notification(source, names):
+    changed = frappe.flags.gpos_catalog_notifications
+    if changed is None:
+        changed = frappe.flags.gpos_catalog_notifications = {"item_group": set(), "price_list": set()}
+        frappe.db.after_commit.add(flush_catalog_notifications)
+        frappe.db.after_rollback.add(reset_catalog_notifications)
+    changed[source].update(name for name in names if name)
+
+
+def reset_catalog_notifications():
+    frappe.flags.gpos_catalog_notifications = None
+
+
+def flush_catalog_notifications():
+    """
+    Publishes the changes the committed transaction collected, one event per
+    affected POS Profile with the item groups and price lists that changed.
+    """
+    changed = frappe.flags.gpos_catalog_notifications
+    reset_catalog_notifications()
+    if not changed:
+        return
+
+    changes = get_pos_profile_changes(changed["item_group"], changed["price_list"])
+    for pos_profile, change in changes.items():
+        publish_catalog_change([pos_profile], change, after_commit=False)
+
+
+def notify_promotion_change(doc, method=None):
+    # Promotions are not part of the catalog change log, terminals reload them with get_promotion_list.
+    pos_profiles = {row.pos_profile for row in doc.pos_profile_table if row.pos_profile}
+    before = doc.get_doc_before_save()
+    if before:
+        pos_profiles.update(row.pos_profile for row in before.pos_profile_table if row.pos_profile)
+    publish_catalog_change(sorted(pos_profiles), {"doctype": "promotion", "name": doc.name})
+
+
+def prune_catalog_change_log():
+    pruned = frappe.get_all(
+        CHANGE_LOG,
+        filters={
+            "creation": ["<", add_days(now_datetime(), -CHANGE_LOG_RETENTION_DAYS)],
+            "seq": ["is", "set"],
+        },
+        order_by="seq desc",
+        limit=1,
+        pluck="seq",
+    )
+    if not pruned:
+        return
+    # Kept so cursors older than the pruned entries get a reset even once the log is empty.
+    pruned_upto = max(cint(pruned[0]), get_pruned_change_seq())
+    frappe.db.set_default(CHANGE_LOG_PRUNED_UPTO, pruned_upto)
+    frappe.db.delete(CHANGE_LOG, {"seq": ["<=", pruned_upto]})
+    frappe.db.commit()
+
+
+def get_pruned_change_seq():
+    return cint(frappe.db.get_default(CHANGE_LOG_PRUNED_UPTO))
+
+
+@frappe.whitelist(allow_guest=True)
+def get_catalog_changes(cursor=0, pos_profile=None, limit=1000):
+    """
+    Returns the catalog changes after `cursor` for a POS Profile.
+
+    `cursor` is the last change sequence the terminal applied, as returned by
+    get_items or a previous call. Upserts use the get_items shape, deletions are
+    reported as tombstones. `reset` is set when the cursor is older than the
+    retained change log and the terminal has to reload the full catalog.
+    """
+    try:
+        cursor = cint(cursor)
+        limit = cint(limit) or 1000
+
+        # Only pruning removes sequenced entries, gaps in the log do not mean a cursor is stale.
+        if cursor and cursor < get_pruned_change_seq():
+            return Response(
+                json.dumps({"data": {"reset": True, "cursor": get_last_change_seq()}}),
+                status=200,
+                mimetype="application/json",
+            )
+
+        changes = frappe.get_all(
+            CHANGE_LOG,
+            filters={"seq": [">", cursor]},
+            fields=["seq", "change_type", "reference_doctype", "reference_name", "item_code", "uom", "price_list"],
+            order_by="seq asc",
+            limit_page_length=limit,
+        )
+
+        price_list = get_pos_price_list(pos_profile)
+        tombstones = {"items": [], "barcodes": [], "uoms": [], "prices": []}
+        upsert_codes = set()
+        deleted_items = set()
+
+        for change in changes:
+            if change.reference_doctype == "Item":
+                if change.change_type == "Delete":
+                    deleted_items.add(change.item_code)
+                    upsert_codes.discard(change.item_code)
+                    continue
+            elif change.reference_doctype == "Item Price":
+                if change.price_list != price_list:
+                    continue
+                if change.change_type == "Delete":
+                    tombstones["prices"].append(
+                        {"id": change.reference_name, "item_code": change.item_code, "uom": change.uom}
+                    )
+            elif change.reference_doctype == "Item Barcode":
+                tombstones["barcodes"].append({"id": change.reference_name, "item_code": change.item_code})
+            elif change.reference_doctype == "UOM Conversion Detail":
+                tombstones["uoms"].append({"id": change.reference_name, "item_code": change.item_code})
+
+            upsert_codes.add(change.item_code)
+            deleted_items.discard(change.item_code)
+
+        items = []
+        if upsert_codes:
+            item_filters = {"name": ["in", list(upsert_codes)]}
+            item_groups = get_pos_item_groups(pos_profile)
+            if item_groups:
+                item_filters["item_group"] = ["in", item_groups]
+            items = frappe.get_all("Item", fields=get_item_fields(), filters=item_filters)
+
+        # Items that left the profile's item groups are deletions for this terminal.
+        deleted_items.update(upsert_codes - {item.name for item in items})
+        tombstones["items"] = sorted(deleted_items)
+
+        data = {
+            "cursor": changes[-1].seq if changes else cursor,
+            "has_more": len(changes) == limit,
+            "upserts": build_grouped_items(items, price_list),
+            "tombstones": tombstones,
+        }
+        return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "get_catalog_changes error")
+        return Response(
+            json.dumps({"error": str(e)}),
+            status=500,
+            mimetype="application/json",
+        )
+
+
+@frappe.whitelist(allow_guest=True)
+def get_catalog_manifest(pos_profile=None, include_items=0):
+    """
+    Content hashes of the POS Profile catalog for a terminal to keep with its
+    copy, per item group and, with include_items, per item.
+    """
+    try:
+        server_groups = get_catalog_hashes(pos_profile)
+        meta = get_catalog_meta(pos_profile)
+        data = {
+            "version": meta["version"],
+            "cursor": meta["cursor"],
+            "item_groups": {item_group: hashes["hash"] for item_group, hashes in server_groups.items()},
+        }
+        if cint(include_items):
+            data["items"] = {
+                item_code: item_hash
+                for hashes in server_groups.values()
+                for item_code, item_hash in hashes["items"].items()
+            }
+        return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "get_catalog_manifest error")
+        return Response(
+            json.dumps({"error": str(e)}),
+            status=500,
+            mimetype="application/json",
+        )
+
+
+@frappe.whitelist(allow_guest=True)
+def get_catalog_diff(manifest, pos_profile=None):
+    """
+    Reconciles a terminal catalog against the server using content hashes.
+
+    `manifest` is a JSON object with `item_groups`, {item_group: hash}, and/or
+    `items`, {item_code: hash}, holding the hashes the server returned earlier.
+
+    With only `item_groups` the changed and deleted item groups are returned so
+    the terminal can send the item hashes of just those groups. With `items`
+    the items whose contents differ are returned as upserts in the get_items
+    shape, along with the item codes to delete. When both are sent, items are
+    only compared within the changed item groups.
+    """
+    try:
+        manifest = json.loads(manifest) if isinstance(manifest, str) else manifest
+        if not isinstance(manifest, dict):
+            raise ValueError
+    except ValueError:
+        return Response(
+            json.dumps({"error": "manifest must be a JSON object"}),
+            status=400,
+            mimetype="application/json",
+        )
+
+    try:
+        server_groups = get_catalog_hashes(pos_profile)
+        meta = get_catalog_meta(pos_profile)
+        data = {"version": meta["version"], "cursor": meta["cursor"]}
+
+        terminal_groups = manifest.get("item_groups")
+        terminal_items = manifest.get("items")
+
+        changed_groups = list(server_groups)
+        if terminal_groups is not None:
+            changed_groups = [
+                item_group
+                for item_group, hashes in server_groups.items()
+                if terminal_groups.get(item_group) != hashes["hash"]
+            ]
+            data["item_groups"] = {
+                "changed": {item_group: server_groups[item_group]["hash"] for item_group in changed_groups},
+                "deleted": [item_group for item_group in terminal_groups if item_group not in server_groups],
+            }
+
+        if terminal_items is not None:
+            upsert_codes = [
+                item_code
+                for item_group in changed_groups
+                for item_code, item_hash in server_groups[item_group]["items"].items()
+                if terminal_items.get(item_code) != item_hash
+            ]
+            server_items = set()
+            for hashes in server_groups.values():
+                server_items.update(hashes["items"])
+
+            upserts = []
+            if upsert_codes:
+                items = frappe.get_all(
+                    "Item",
+                    fields=get_item_fields(),
+                    filters={"name": ["in", upsert_codes]},
+                )
+                upserts = build_grouped_items(items, meta["price_list"])
+
+            item_hashes = {}
+            for item_group in upserts:
+                item_hashes.update(hash_item_group(item_group)[1])
+
+            data["upserts"] = upserts
+            data["hashes"] = item_hashes
+            data["deletes"] = sorted(item_code for item_code in terminal_items if item_code not in server_items)
+
+        return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "get_catalog_diff error")
+        return Response(
+            json.dumps({"error": str(e)}),
+            status=500,
+            mimetype="application/json",
+        )
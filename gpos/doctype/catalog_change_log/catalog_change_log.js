@@ -0,0 +1,8 @@
+// Copyright (c) 2026, ERPGulf and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Catalog Change Log", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -6,6 +6,7 @@ from frappe.model.document import Document
 import frappe
 from frappe.model.document import Document
 from frappe.utils import add_days, getdate
+from gpos.gpos.settings import get_settings
 class LoyaltyPointEntryGpos(Document):
     pass
 
@@ -14,7 +15,7 @@ class LoyaltyPointEntryGpos(Document):
 
     def set_expiry_date(self):
 
-        settings = frappe.get_single("Loyalty Point Setting")
+        settings = get_settings("Loyalty Point Setting")
 
         valid_days = settings.valid_days or 0
 
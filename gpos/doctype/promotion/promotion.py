@@ -4,6 +4,8 @@
 import frappe
 from frappe.model.document import Document
 
+from gpos.gpos.price_matrix import get_price
+
 class promotion(Document):
 	pass
 
@@ -14,14 +16,7 @@ class promotion(Document):
 @frappe.whitelist()
 def get_item_price(item_code,price_list,uom=None):
     try:
-        filters = {"item_code": item_code, "price_list": price_list}
-        if uom:
-            filters["uom"] = uom
-        price = frappe.db.get_value(
-            "Item Price",
-            filters,
-            "price_list_rate"
-        )
+        price = get_price(item_code, price_list, uom)
         return {"price": float(price or 0)}
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Item Price Fetch Error")
@@ -4,6 +4,24 @@
 # import frappe
 from frappe.model.document import Document
 
+from gpos.gpos.barcode import decode_scale_barcode_list, get_barcode_lookup
+from gpos.gpos.catalog import DEFAULT_PRICE_LIST
+
 
 class WarehouseStockLog(Document):
-	pass
+
+	def validate(self):
+		self.set_item_from_barcode()
+
+	def set_item_from_barcode(self):
+		if not self.barcode or self.item_code:
+			return
+
+		entry = get_barcode_lookup().get(self.barcode)
+		if entry:
+			self.item_code, self.uom = entry[0], entry[2]
+			return
+
+		decoded, _ = decode_scale_barcode_list([self.barcode], DEFAULT_PRICE_LIST)
+		if decoded:
+			self.item_code, self.uom = decoded[0]["item_code"], decoded[0]["uom"]
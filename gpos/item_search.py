@@ -0,0 +1,282 @@
+import heapq
+import json
+import re
+from bisect import bisect_left
+from functools import partial
+
+import frappe
+from frappe.utils import cint
+from werkzeug.wrappers import Response
+
+from gpos.gpos.barcode import get_index_version
+from gpos.gpos.catalog import OPTIONAL_ITEM_FIELDS, get_item_names, get_pos_item_groups
+
+# Items are searched through an in-memory token index kept per worker and per
+# site. Tokens are normalized so Arabic spelling variants and diacritics match,
+# and are kept sorted so a prefix lookup is a bisect.
+#
+# Like the price matrix, an Item change is appended to a journal in the shared
+# cache after commit, with the item as indexed, and every worker applies the
+# new entries to its index on its next search. A changed item is appended
+# again and its old position left empty. When the journal grows past
+# ITEM_SEARCH_JOURNAL_LIMIT the version is changed instead and workers rebuild.
+
+ITEM_SEARCH_INDEX_VERSION = "gpos_item_search_index_version"
+ITEM_SEARCH_JOURNAL = "gpos_item_search_journal"
+ITEM_SEARCH_JOURNAL_LIMIT = 1000
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 200
+
+# Scores of a match on a whole code or barcode, a whole token and a token prefix.
+EXACT_CODE_SCORE = 100
+TOKEN_SCORE = 2
+PREFIX_SCORE = 1
+
+# Harakat, Quranic marks, superscript alef and tatweel.
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_LETTERS = str.maketrans(
+    {
+        "أ": "ا",  # alef with hamza above
+        "إ": "ا",  # alef with hamza below
+        "آ": "ا",  # alef with madda
+        "ٱ": "ا",  # alef wasla
+        "ى": "ي",  # alef maksura
+        "ة": "ه",  # teh marbuta
+        "ؤ": "و",  # waw with hamza
+        "ئ": "ي",  # yeh with hamza
+        **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+        **{chr(0x06F0 + digit): str(digit) for digit in range(10)},  # Eastern Arabic-Indic digits
+    }
+)
+TOKEN_SEPARATORS = re.compile(r"[\W_]+")
+
+_search_indexes = {}
+
+
+def normalize(text):
+    """
+    Lower cases text and folds Arabic diacritics, tatweel, letter variants and digits.
+    """
+    return ARABIC_DIACRITICS.sub("", (text or "").casefold()).translate(ARABIC_LETTERS)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_SEPARATORS.split(normalize(text)) if token]
+
+
+def reset_item_search_index():
+    frappe.cache().delete_value(ITEM_SEARCH_JOURNAL)
+    frappe.cache().set_value(ITEM_SEARCH_INDEX_VERSION, frappe.generate_hash(length=10))
+
+
+def get_search_item_fields():
+    item_meta = frappe.get_meta("Item")
+    return ["name", "item_name", "item_group", "disabled"] + [
+        fieldname for fieldname in OPTIONAL_ITEM_FIELDS if item_meta.has_field(fieldname)
+    ]
+
+
+def make_search_entry(item, barcodes):
+    """
+    {"item": (item_code, item_name, english, arabic, item_group, disabled),
+     "codes": [item code and barcodes], "tokens": [tokens]} of one Item row.
+    """
+    english, arabic = get_item_names(item)
+    codes = [item.name] + barcodes
+    tokens = set()
+    for code in codes:
+        tokens.update(tokenize(code))
+    for name in (item.item_name, english, arabic):
+        tokens.update(tokenize(name))
+    return {
+        "item": (item.name, item.item_name, english, arabic, item.item_group, cint(item.disabled)),
+        "codes": codes,
+        "tokens": sorted(tokens),
+    }
+
+
+def build_item_search_index():
+    """
+    {"items": [(item_code, item_name, english, arabic, item_group, disabled) or None],
+     "positions": {item_code: item position},
+     "codes": {normalized code or barcode: [item positions]},
+     "tokens": sorted tokens, "postings": [item positions per token]}
+    """
+    barcodes = {}
+    for barcode in frappe.get_all("Item Barcode", filters={"parenttype": "Item"}, fields=["parent", "barcode"]):
+        barcodes.setdefault(barcode.parent, []).append(barcode.barcode)
+
+    items = []
+    positions = {}
+    codes = {}
+    postings = {}
+    for position, item in enumerate(frappe.get_all("Item", fields=get_search_item_fields(), order_by="name")):
+        entry = make_search_entry(item, barcodes.get(item.name, []))
+        items.append(entry["item"])
+        positions[item.name] = position
+        for code in entry["codes"]:
+            codes.setdefault(normalize(code), []).append(position)
+        for token in entry["tokens"]:
+            postings.setdefault(token, []).append(position)
+
+    tokens = sorted(postings)
+    return {
+        "items": items,
+        "positions": positions,
+        "codes": codes,
+        "tokens": tokens,
+        "postings": [postings[token] for token in tokens],
+    }
+
+
+def apply_journal(index, entries):
+    for entry in entries:
+        entry = json.loads(entry)
+        previous = index["positions"].pop(entry["item_code"], None)
+        if previous is not None:
+            index["items"][previous] = None
+        if not entry.get("item"):
+            continue
+
+        position = len(index["items"])
+        index["items"].append(tuple(entry["item"]))
+        index["positions"][entry["item_code"]] = position
+        for code in entry["codes"]:
+            index["codes"].setdefault(normalize(code), []).append(position)
+
+        tokens = index["tokens"]
+        for token in entry["tokens"]:
+            token_position = bisect_left(tokens, token)
+            if token_position < len(tokens) and tokens[token_position] == token:
+                index["postings"][token_position].append(position)
+            else:
+                tokens.insert(token_position, token)
+                index["postings"].insert(token_position, [position])
+
+
+def get_item_search_index():
+    version = get_index_version(ITEM_SEARCH_INDEX_VERSION)
+    journal_length = frappe.cache().llen(ITEM_SEARCH_JOURNAL)
+
+    cached = _search_indexes.get(frappe.local.site)
+    if not cached or cached["version"] != version:
+        # Entries journaled while building are applied again next time, which is harmless.
+        cached = {"version": version, "applied": journal_length, "index": build_item_search_index()}
+        _search_indexes[frappe.local.site] = cached
+    elif journal_length > cached["applied"]:
+        apply_journal(
+            cached["index"], frappe.cache().lrange(ITEM_SEARCH_JOURNAL, cached["applied"], journal_length - 1)
+        )
+        cached["applied"] = journal_length
+    return cached["index"]
+
+
+def journal_item(item_code):
+    if frappe.cache().llen(ITEM_SEARCH_JOURNAL) >= ITEM_SEARCH_JOURNAL_LIMIT:
+        reset_item_search_index()
+        return
+
+    entry = {"item_code": item_code}
+    item = frappe.get_all("Item", filters={"name": item_code}, fields=get_search_item_fields())
+    if item:
+        barcodes = frappe.get_all(
+            "Item Barcode", filters={"parenttype": "Item", "parent": item_code}, pluck="barcode"
+        )
+        entry.update(make_search_entry(item[0], barcodes))
+    frappe.cache().rpush(ITEM_SEARCH_JOURNAL, json.dumps(entry))
+
+
+def match_term(index, term):
+    """
+    {item position: score} of the items with a token starting with `term`.
+    """
+    tokens = index["tokens"]
+    matched = {}
+    position = bisect_left(tokens, term)
+    while position < len(tokens) and tokens[position].startswith(term):
+        score = TOKEN_SCORE if tokens[position] == term else PREFIX_SCORE
+        for item in index["postings"][position]:
+            if matched.get(item, 0) < score:
+                matched[item] = score
+        position += 1
+    return matched
+
+
+def search(index, query, item_groups=None, include_disabled=False, limit=SEARCH_LIMIT):
+    """
+    Ranked items matching every term of the query as a token prefix, or the
+    whole query as an item code or barcode.
+    """
+    scores = None
+    for term in tokenize(query):
+        matched = match_term(index, term)
+        if scores is None:
+            scores = matched
+        else:
+            scores = {item: score + matched[item] for item, score in scores.items() if item in matched}
+        if not scores:
+            break
+    scores = scores or {}
+
+    for item in index["codes"].get(normalize(query).strip(), []):
+        scores[item] = scores.get(item, 0) + EXACT_CODE_SCORE
+
+    items = index["items"]
+    item_groups = set(item_groups) if item_groups else None
+    ranked = heapq.nsmallest(
+        limit,
+        (
+            (-score, len(items[item][1] or ""), items[item][0], item)
+            for item, score in scores.items()
+            if items[item]
+            and (include_disabled or not items[item][5])
+            and (item_groups is None or items[item][4] in item_groups)
+        ),
+    )
+
+    results = []
+    for score, _, _, position in ranked:
+        item = items[position]
+        results.append(
+            {
+                "item_code": item[0],
+                "item_name": item[1],
+                "item_name_english": item[2],
+                "item_name_arabic": item[3],
+                "item_group": item[4],
+                "disabled": item[5],
+                "score": -score,
+            }
+        )
+    return results
+
+
+def on_item_change(doc, method=None):
+    # Journaled after commit: a rolled back change is never pushed, and a
+    # worker building its index before the push already sees the new item.
+    frappe.db.after_commit.add(partial(journal_item, doc.name))
+
+
+@frappe.whitelist(allow_guest=True)
+def search_items(query, pos_profile=None, limit=SEARCH_LIMIT, include_disabled=0):
+    """
+    Searches items by code, barcode, name, English name and Arabic name.
+    Results are limited to the item groups of the POS Profile when given.
+    """
+    limit = min(cint(limit) or SEARCH_LIMIT, MAX_SEARCH_LIMIT)
+    if not normalize(query).strip():
+        return Response(
+            json.dumps({"error": "query is required"}),
+            status=400,
+            mimetype="application/json",
+        )
+
+    data = search(
+        get_item_search_index(),
+        query,
+        item_groups=get_pos_item_groups(pos_profile),
+        include_disabled=cint(include_disabled),
+        limit=limit,
+    )
+    return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
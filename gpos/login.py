@@ -0,0 +1,94 @@
+import json
+
+import frappe
+from frappe.utils import now_datetime
+
+from gpos.gpos.settings import get_settings
+
+# Login responses are assembled from a cached profile per user, dropped when
+# the User or Claudion POS setting changes. Login attempts are appended to a
+# redis list and written to gpos logs in batches by a scheduled job, so the
+# login request itself writes nothing but the token.
+
+LOGIN_PROFILES = "gpos_login_profiles"
+LOGIN_AUDIT = "gpos_login_audit"
+LOGIN_AUDIT_BATCH = 1000
+
+
+def get_login_profile(username):
+    """
+    {"user": {"id", "full_name", "phone", "email"}, "branch_id": ...} of a login.
+    """
+    def build():
+        user = frappe.db.get_value(
+            "User",
+            username,
+            ["name as id", "full_name", "mobile_no as phone", "email"],
+            as_dict=True,
+        )
+        return {
+            "user": dict(user) if user else {},
+            "branch_id": get_settings("Claudion POS setting").branch,
+        }
+
+    return frappe.cache().hget(LOGIN_PROFILES, username, generator=build)
+
+
+def on_user_change(doc, method=None):
+    frappe.cache().hdel(LOGIN_PROFILES, doc.name)
+
+
+def on_pos_setting_change(doc, method=None):
+    frappe.cache().delete_value(LOGIN_PROFILES)
+
+
+def audit_login(username, app_key, status):
+    frappe.cache().rpush(
+        LOGIN_AUDIT,
+        json.dumps(
+            {
+                "user": username,
+                "app_key": app_key,
+                "status": status,
+                "ip": frappe.local.request_ip,
+                "time": str(now_datetime()),
+            }
+        ),
+    )
+
+
+def flush_login_audit():
+    """
+    Scheduled every minute. Moves the queued login attempts to gpos logs.
+    """
+    while True:
+        entries = frappe.cache().lrange(LOGIN_AUDIT, 0, LOGIN_AUDIT_BATCH - 1)
+        if not entries:
+            return
+
+        now = now_datetime()
+        values = []
+        for entry in entries:
+            entry = json.loads(entry)
+            values.append(
+                (
+                    frappe.generate_hash(length=10),
+                    now,
+                    now,
+                    "Administrator",
+                    "Administrator",
+                    entry["time"],
+                    "Login",
+                    json.dumps(entry),
+                )
+            )
+        frappe.db.bulk_insert(
+            "gpos logs",
+            ["name", "creation", "modified", "owner", "modified_by", "fatetime", "location", "details"],
+            values,
+        )
+        frappe.db.commit()
+        frappe.cache().ltrim(LOGIN_AUDIT, len(entries), -1)
+
+        if len(entries) < LOGIN_AUDIT_BATCH:
+            return
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import time
+from urllib.parse import urlencode
+
+import frappe
+from frappe.integrations.oauth2 import get_oauth_server
+
+# Tokens are issued by calling Frappe's OAuth server inside the current
+# request, instead of posting to /api/method/frappe.integrations.oauth2.get_token
+# on the same bench, which held a second worker for every login.
+
+OAUTH_CLIENTS = "gpos_oauth_clients"
+
+# Concurrent refreshes of one refresh token are coalesced: the first request
+# takes a short lock and exchanges the token, the others wait for its result,
+# which is kept for REFRESH_RESULT_SECONDS so retries get the same answer
+# instead of failing on the already rotated token.
+REFRESH_LOCK_SECONDS = 10
+REFRESH_RESULT_SECONDS = 30
+REFRESH_WAIT_SECONDS = 5
+
+
+def get_oauth_client(app_key):
+    """
+    (client_id, client_secret, user) of the OAuth Client of an app, cached
+    until an OAuth Client changes. None when there is no such client.
+    """
+    def build():
+        client = frappe.db.get_value(
+            "OAuth Client",
+            {"app_name": app_key},
+            ["client_id", "client_secret", "user"],
+        )
+        # Cached as a list, an unknown app key is cached as an empty one.
+        return list(client) if client else []
+
+    client = frappe.cache().hget(OAUTH_CLIENTS, app_key, generator=build)
+    return tuple(client) if client else None
+
+
+def on_oauth_client_change(doc, method=None):
+    frappe.cache().delete_value(OAUTH_CLIENTS)
+
+
+def get_token(payload):
+    """
+    Runs a token request through the OAuth server in-process.
+    Returns (status_code, response body as a dict).
+    """
+    # The validator authenticates the client against the session user, which
+    # is Guest for the get_token HTTP endpoint. Run the grant the same way
+    # whoever is calling.
+    user = frappe.session.user
+    frappe.set_user("Guest")
+    try:
+        _, body, status = get_oauth_server().create_token_response(
+            frappe.local.conf.host_name + "/api/method/frappe.integrations.oauth2.get_token",
+            "POST",
+            urlencode(payload),
+            {"Content-Type": "application/x-www-form-urlencoded"},
+            frappe.flags.oauth_credentials,
+        )
+    finally:
+        frappe.set_user(user)
+    return status, json.loads(body)
+
+
+def get_password_token(app_key, username, password):
+    """
+    Password grant for a user through the OAuth Client of the app.
+    Returns (status_code, body), or None when the app key is unknown.
+    """
+    client = get_oauth_client(app_key)
+    if not client or not client[0]:
+        return None
+
+    client_id, client_secret, _ = client
+    try:
+        return get_token(
+            {
+                "username": username,
+                "password": password,
+                "grant_type": "password",
+                "client_id": client_id,
+                "client_secret": client_secret,
+            }
+        )
+    except frappe.AuthenticationError:
+        # Wrong credentials raise in LoginManager.authenticate instead of becoming an OAuth error.
+        frappe.clear_messages()
+        return 401, {"error": "invalid_grant", "error_description": "Invalid login credentials"}
+    except frappe.SecurityException:
+        # Raised by the login attempt tracker after too many failed attempts.
+        frappe.clear_messages()
+        return 401, {"error": "invalid_grant", "error_description": "Too many failed login attempts"}
+
+
+def get_refresh_token(refresh_token):
+    """
+    Refresh token grant, coalesced per refresh token. Returns (status_code,
+    body), or None when another request is still exchanging the same token.
+    """
+    key = "gpos_oauth_refresh|" + hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()
+    result_key = key + "|result"
+    # Read with expires=True so the result is not memoized in frappe.local.cache,
+    # which would pin the first empty read for the rest of the request.
+
+    result = frappe.cache().get_value(result_key, expires=True)
+    if result:
+        return tuple(result)
+
+    if not frappe.cache().set(frappe.cache().make_key(key), 1, nx=True, ex=REFRESH_LOCK_SECONDS):
+        deadline = time.monotonic() + REFRESH_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            result = frappe.cache().get_value(result_key, expires=True)
+            if result:
+                return tuple(result)
+        return None
+
+    try:
+        payload = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+        client_id = frappe.db.get_value("OAuth Bearer Token", {"refresh_token": refresh_token}, "client")
+        if client_id:
+            payload["client_id"] = client_id
+        result = get_token(payload)
+        frappe.cache().set_value(result_key, list(result), expires_in_sec=REFRESH_RESULT_SECONDS)
+        return result
+    finally:
+        frappe.cache().delete_value(key)
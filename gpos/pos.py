@@ -4,9 +4,10 @@ import json
 import frappe
 import urllib.parse
 import base64
+import hashlib
 from werkzeug.wrappers import Response
 from frappe.utils import now_datetime
-from frappe.utils.password import get_decrypted_password
+from frappe.utils.password import decrypt
 from frappe.utils.image import optimize_image
 from mimetypes import guess_type
 from frappe.utils import now_datetime, cint
@@ -17,6 +18,27 @@ from frappe import ValidationError
 from frappe.utils import add_days, getdate
 
 from datetime import datetime
+from gpos.gpos.catalog import (
+    CATALOG_FIELDS,
+    build_grouped_items,
+    decode_page_token,
+    encode_page_token,
+    get_catalog_hashes,
+    get_catalog_item_groups,
+    get_catalog_meta,
+    get_catalog_shard,
+    get_catalog_snapshot,
+    get_item_fields,
+    get_last_change_seq,
+    get_pos_item_groups,
+    get_pos_price_list,
+    iter_item_batches,
+)
+from gpos.gpos.catalog_index import get_existing_item_codes
+from gpos.gpos.login import audit_login, get_login_profile
+from gpos.gpos.oauth import get_password_token, get_refresh_token
+from gpos.gpos.price_matrix import is_selling_price_list, price_list_not_allowed
+from gpos.gpos.settings import get_settings
 BACKEND_SERVER_SETTINGS = "Backend Server Settings"
 @frappe.whitelist(allow_guest=True)
 def generate_token_secure(api_key, api_secret, app_key):
@@ -34,19 +56,9 @@ def generate_token_secure(api_key, api_secret, app_key):
                 mimetype="application/json",
             )
 
-        clientID, clientSecret, clientUser = frappe.db.get_value(
-            "OAuth Client",
-            {"app_name": app_key},
-            ["client_id", "client_secret", "user"],
-        )
-        doc = frappe.db.get_value(
-            "OAuth Client",
-            {"app_name": app_key},
-            ["name", "client_id", "client_secret", "user"],
-        )
+        token = get_password_token(app_key, api_key, api_secret)
 
-        if clientID is None:
-            # return app_key
+        if token is None:
             return Response(
                 json.dumps(
                     {"message": "Security Parameters are not valid", "user_count": 0}
@@ -55,29 +67,8 @@ def generate_token_secure(api_key, api_secret, app_key):
                 mimetype="application/json",
             )
 
-        client_id = clientID  # Replace with your OAuth client ID
-        client_secret = clientSecret  # Replace with your OAuth client secret
-
-        url = (
-            frappe.local.conf.host_name
-            + "/api/method/frappe.integrations.oauth2.get_token"
-        )
-
-        payload = {
-            "username": api_key,
-            "password": api_secret,
-            "grant_type": "password",
-            "client_id": client_id,
-            "client_secret": client_secret,
-        }
-        files = []
-        headers = {"Content-Type": "application/json"}
-
-        response = requests.request("POST", url, data=payload, files=files)
-
-        if response.status_code == 200:
-
-            result_data = json.loads(response.text)
+        status, result_data = token
+        if status == 200:
 
             return Response(
                 json.dumps({"data": result_data}),
@@ -88,12 +79,12 @@ def generate_token_secure(api_key, api_secret, app_key):
         else:
 
             frappe.local.response.http_status_code = 401
-            return json.loads(response.text)
+            return result_data
 
     except Exception as e:
 
         return Response(
-            json.dumps({"message": e, "user_count": 0}),
+            json.dumps({"message": str(e), "user_count": 0}),
             status=500,
             mimetype="application/json",
         )
@@ -112,19 +103,10 @@ def generate_token_for_offline_user(api_key, api_secret, app_key):
                 status=401,
                 mimetype="application/json",
             )
-        clientID, clientSecret, clientUser = frappe.db.get_value(
-            "OAuth Client",
-            {"app_name": app_key},
-            ["client_id", "client_secret", "user"],
-        )
-        doc = frappe.db.get_value(
-            "OAuth Client",
-            {"app_name": app_key},
-            ["name", "client_id", "client_secret", "user"],
-        )
 
-        if clientID is None:
-            # return app_key
+        token = get_password_token(app_key, api_key, api_secret)
+
+        if token is None:
             return Response(
                 json.dumps(
                     {"message": "Security Parameters are not valid", "user_count": 0}
@@ -133,29 +115,8 @@ def generate_token_for_offline_user(api_key, api_secret, app_key):
                 mimetype="application/json",
             )
 
-        client_id = clientID  # Replace with your OAuth client ID
-        client_secret = clientSecret  # Replace with your OAuth client secret
-
-        url = (
-            frappe.local.conf.host_name
-            + "/api/method/frappe.integrations.oauth2.get_token"
-        )
-
-        payload = {
-            "username": api_key,
-            "password": api_secret,
-            "grant_type": "password",
-            "client_id": client_id,
-            "client_secret": client_secret,
-        }
-        files = []
-        headers = {"Content-Type": "application/json"}
-
-        response = requests.request("POST", url, data=payload, files=files)
-
-        if response.status_code == 200:
-
-            result_data = json.loads(response.text)
+        status, result_data = token
+        if status == 200:
 
             return Response(
                 json.dumps({"data": result_data}),
@@ -166,12 +127,12 @@ def generate_token_for_offline_user(api_key, api_secret, app_key):
         else:
 
             frappe.local.response.http_status_code = 401
-            return json.loads(response.text)
+            return result_data
 
     except Exception as e:
 
         return Response(
-            json.dumps({"message": e, "user_count": 0}),
+            json.dumps({"message": str(e), "user_count": 0}),
             status=500,
             mimetype="application/json",
         )
@@ -179,64 +140,81 @@ def generate_token_for_offline_user(api_key, api_secret, app_key):
 
 @frappe.whitelist(allow_guest=True)
 def create_refresh_token(refresh_token):
-    url = (
-        frappe.local.conf.host_name + "/api/method/frappe.integrations.oauth2.get_token"
-    )
+    token = get_refresh_token(refresh_token)
 
-    payload = f"grant_type=refresh_token&refresh_token={refresh_token}"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    files = []
-    response = requests.post(url, headers=headers, data=payload, files=files)
+    if token is None:
+        return Response(
+            json.dumps({"data": "Token refresh already in progress, retry"}),
+            status=503,
+            mimetype="application/json",
+            headers={"Retry-After": "1"},
+        )
 
-    if response.status_code == 200:
-        try:
-            message_json = json.loads(response.text)
-            new_message = {
-                "access_token": message_json["access_token"],
-                "expires_in": message_json["expires_in"],
-                "token_type": message_json["token_type"],
-                "scope": message_json["scope"],
-                "refresh_token": message_json["refresh_token"],
-            }
+    status, message_json = token
+    if status == 200:
+        new_message = {
+            "access_token": message_json["access_token"],
+            "expires_in": message_json["expires_in"],
+            "token_type": message_json["token_type"],
+            "scope": message_json["scope"],
+            "refresh_token": message_json["refresh_token"],
+        }
 
-            return Response(
-                json.dumps({"data": new_message}),
-                status=200,
-                mimetype="application/json",
-            )
-        except json.JSONDecodeError as e:
-            return Response(
-                json.dumps({"data": f"Error decoding JSON: {e}"}),
-                status=401,
-                mimetype="application/json",
-            )
+        return Response(
+            json.dumps({"data": new_message}),
+            status=200,
+            mimetype="application/json",
+        )
     else:
         return Response(
-            json.dumps({"data": response.text}), status=401, mimetype="application/json"
+            json.dumps({"data": json.dumps(message_json)}), status=401, mimetype="application/json"
         )
 
 
 @frappe.whitelist(allow_guest=True)
-def get_items(item_group=None, last_updated_time=None, pos_profile = None):
+def get_items(item_group=None, last_updated_time=None, pos_profile = None, fields="full"):
 
 
     try:
-        item_filters = {}
-        pos_item_groups = []
-        if pos_profile:
-            pos = frappe.get_doc("POS Profile", pos_profile)
-            pos_item_groups = [d.item_group for d in pos.item_groups]
-
-
-            if pos_item_groups:
-                item_filters["item_group"] = ["in", pos_item_groups]
-
+        if fields not in CATALOG_FIELDS:
+            return Response(
+                json.dumps({"error": "fields must be one of " + ", ".join(CATALOG_FIELDS)}),
+                status=400,
+                mimetype="application/json"
+            )
 
-        fields = ["name", "stock_uom", "item_name", "item_group", "description", "modified","disabled"]
-        # filters = {"item_group": ["like", f"%{item_group}%"]} if item_group else {}
+        if not item_group and not last_updated_time and fields == "full":
+            try:
+                snapshot = get_catalog_snapshot(pos_profile)
+            except frappe.DoesNotExistError:
+                return Response(
+                    json.dumps({"error": "POS Profile not found"}),
+                    status=404,
+                    mimetype="application/json"
+                )
+            if not snapshot["count"]:
+                return Response(
+                    json.dumps({"error": "No items found"}),
+                    status=404,
+                    mimetype="application/json"
+                )
+            return Response(
+                '{"data": %s, "version": "%s", "cursor": %d}'
+                % (snapshot["data"], snapshot["version"], snapshot["cursor"]),
+                status=200,
+                mimetype="application/json"
+            )
 
-        if item_group:
-            item_filters["item_group"] = ["like", f"%{item_group}%"]
+        item_filters = {}
+        item_groups = get_catalog_item_groups(pos_profile, item_group)
+        if item_groups is not None:
+            if not item_groups:
+                return Response(
+                    json.dumps({"error": "No items found"}),
+                    status=404,
+                    mimetype="application/json"
+                )
+            item_filters["item_group"] = ["in", item_groups]
 
         item_codes_set = set()
 
@@ -276,118 +254,8 @@ def get_items(item_group=None, last_updated_time=None, pos_profile = None):
 
             item_filters["name"] = ["in", list(item_codes_set)]
 
-        items = frappe.get_all("Item", fields=fields, filters=item_filters)
-        item_meta = frappe.get_meta("Item")
-        has_arabic = "custom_item_name_arabic" in [df.fieldname for df in item_meta.fields]
-        has_english = "custom_item_name_in_english" in [
-            df.fieldname for df in item_meta.fields
-        ]
-
-        grouped_items = {}
-
-        for item in items:
-            # Commented by Farook to send disabled tag on api, to handle from offline side properly
-            # if item.disabled == 1:
-            #     continue
-
-            item_group_disabled = frappe.db.get_value(
-                "Item Group", item.item_group, "custom_disabled"
-            )
-
-
-            if item.item_group not in grouped_items:
-                grouped_items[item.item_group] = {
-                    "item_group_id": item.item_group,
-                    "item_group": item.item_group,
-                    "item_group_disabled": bool(item_group_disabled),
-                    "items": [] if not item_group_disabled else [],
-                    "disabled": item.disabled,
-                }
-
-            if not item_group_disabled:
-                item_doc = frappe.get_doc("Item", item.name)
-
-
-                item_name_arabic = ""
-                item_name_english = ""
-
-                if has_arabic and item_doc.get("custom_item_name_arabic"):
-                    item_name_arabic = item_doc.custom_item_name_arabic
-                    item_name_english = item.item_name
-                elif has_english and item_doc.get("custom_item_name_in_english"):
-                    item_name_arabic = item.item_name
-                    item_name_english = item_doc.custom_item_name_in_english
-
-                uoms = frappe.get_all(
-                    "UOM Conversion Detail",
-                    filters={"parent": item.name},
-                    fields=["name", "uom", "conversion_factor"],
-                )
-
-                barcodes = frappe.get_all(
-                    "Item Barcode",
-                    filters={"parent": item.name},
-                    fields=["name", "barcode", "uom", "custom_editable_price", "custom_editable_quantity"],
-                )
-
-                price_list = "Retail Price"
-                if pos_profile:
-                    price_list = frappe.db.get_value(
-                        "POS Profile", pos_profile, "selling_price_list"
-                    ) or "Retail Price"
-
-                item_prices = frappe.get_all(
-                    "Item Price",
-                    fields=["price_list_rate", "uom", "creation"],
-                    filters={"item_code": item.name, "price_list": price_list},
-                    order_by="creation",
-                )
-
-                price_map = {price.uom: price.price_list_rate for price in item_prices}
-                barcode_map = {}
-                for barcode in barcodes:
-                    if barcode.uom in barcode_map:
-                        barcode_map[barcode.uom].append(barcode.barcode)
-                    else:
-                        barcode_map[barcode.uom] = [barcode.barcode]
-
-                grouped_items[item.item_group]["items"].append(
-                    {
-                        "item_id": item.name,
-                        "item_code": item.name,
-                        "item_name": item.item_name,
-                        "item_name_english": item_name_english,
-                        "item_name_arabic": item_name_arabic,
-                        "tax_percentage": (item.get("custom_tax_percentage") or 0.0),
-                        "description": item.description,
-                        "disabled": item.disabled,
-                        "barcodes": [
-                            {
-                                "id": barcode.name,
-                                "barcode": barcode.barcode,
-                                "uom": barcode.uom,
-                            }
-                            for barcode in barcodes
-                        ],
-                        "uom": [
-                            {
-                                "id": uom.name,
-                                "uom": uom.uom,
-                                "conversion_factor": uom.conversion_factor,
-                                "price": round(price_map.get(uom.uom, 0.0), 2),
-                                "barcode": ", ".join(barcode_map.get(uom.uom, [])),
-                                "editable_price": bool(
-                                    frappe.get_value("UOM", uom.uom, "custom_editable_price")
-                                ),
-                                "editable_quantity": bool(
-                                    frappe.get_value("UOM", uom.uom, "custom_editable_quantity")
-                                ),
-                            }
-                            for uom in uoms
-                        ],
-                    }
-                )
-        result = list(grouped_items.values())
+        items = frappe.get_all("Item", fields=get_item_fields(fields), filters=item_filters)
+        result = build_grouped_items(items, get_pos_price_list(pos_profile), fields)
 
 
         if not result:
@@ -411,19 +279,75 @@ def get_items(item_group=None, last_updated_time=None, pos_profile = None):
 
 
 
+ITEMS_PAGE_MAX_LIMIT = 500
+
+
 @frappe.whitelist(allow_guest=True)
-def get_items_page(item_group=None, last_updated_time=None, limit=50, offset=0):
-    import json
-    from datetime import datetime
+def get_items_page(
+    item_group=None,
+    last_updated_time=None,
+    limit=50,
+    offset=0,
+    page_token=None,
+    pos_profile=None,
+    price_list=None,
+    fields="full",
+):
+    """
+    Pages through the catalog ordered by item group and item code.
+
+    Pass the returned next_page_token to get the following page; it seeks past
+    the last item instead of skipping rows, so every page costs the same. A
+    group only continues on the next page when it is cut by the page end.
+    offset is kept for older terminals and is ignored once a token is given.
+    limit is clamped to 1..ITEMS_PAGE_MAX_LIMIT.
+    fields selects the "full", "prices" or "barcodes" projection of the items.
+    """
+    try:
+        limit = int(limit)
+        offset = int(offset)
+    except ValueError:
+        return Response(
+            json.dumps({"error": "Invalid limit or offset. Must be integers."}),
+            status=400,
+            mimetype="application/json",
+        )
+
+    limit = min(max(limit, 1), ITEMS_PAGE_MAX_LIMIT)
+    offset = max(offset, 0)
 
-    # from werkzeug.wrappers import Response
+    if price_list and not is_selling_price_list(price_list):
+        return price_list_not_allowed(price_list)
+
+    if fields not in CATALOG_FIELDS:
+        return Response(
+            json.dumps({"error": "fields must be one of " + ", ".join(CATALOG_FIELDS)}),
+            status=400,
+            mimetype="application/json",
+        )
 
-    fields = ["name", "stock_uom", "item_name", "item_group", "description", "modified"]
-    item_filters = {}
-    if item_group:
-        item_filters["item_group"] = ["like", f"%{item_group}%"]
+    try:
+        token = decode_page_token(page_token) if page_token else None
+    except ValueError:
+        return Response(
+            json.dumps({"error": "Invalid page_token."}),
+            status=400,
+            mimetype="application/json",
+        )
 
-    item_codes_set = set()
+    conditions = []
+    values = {}
+
+    item_groups = get_catalog_item_groups(pos_profile, item_group)
+    if item_groups is not None:
+        if not item_groups:
+            return Response(
+                json.dumps({"data": [], "next_page_token": None, "total": 0, "remaining": 0}),
+                status=200,
+                mimetype="application/json",
+            )
+        conditions.append("item_group in %(item_groups)s")
+        values["item_groups"] = tuple(item_groups)
 
     if last_updated_time:
         try:
@@ -438,129 +362,220 @@ def get_items_page(item_group=None, last_updated_time=None, limit=50, offset=0):
             )
 
         # Get items modified after last_updated_time
-        modified_item_filters = item_filters.copy()
-        modified_item_filters["modified"] = [">", last_updated_dt]
-        modified_items = frappe.get_all(
-            "Item", fields=["name"], filters=modified_item_filters
+        item_codes_set = set(
+            frappe.get_all("Item", filters={"modified": [">", last_updated_dt]}, pluck="name")
         )
-        item_codes_set.update([item["name"] for item in modified_items])
 
         # Get item codes from modified Item Price
-        price_items = frappe.get_all(
-            "Item Price",
-            fields=["item_code"],
-            filters={"modified": [">", last_updated_dt]},
+        item_codes_set.update(
+            frappe.get_all(
+                "Item Price",
+                filters={"modified": [">", last_updated_dt]},
+                pluck="item_code",
+            )
         )
-        item_codes_set.update([p["item_code"] for p in price_items])
 
         if not item_codes_set:
             return Response(
-                json.dumps({"data": []}), status=200, mimetype="application/json"
+                json.dumps({"data": [], "next_page_token": None, "total": 0, "remaining": 0}),
+                status=200,
+                mimetype="application/json",
             )
 
-        item_filters["name"] = ["in", list(item_codes_set)]
+        conditions.append("name in %(item_codes)s")
+        values["item_codes"] = tuple(item_codes_set)
+
+    where = " and ".join(conditions) or "1=1"
+
+    if token:
+        total = token["total"]
+        seen = token["seen"]
+        # The leading item_group bound lets the (item_group, name) index start at the token.
+        page_where = where + (
+            " and item_group >= %(after_group)s"
+            " and (item_group > %(after_group)s"
+            " or (item_group = %(after_group)s and name > %(after_name)s))"
+        )
+        values.update(after_group=token["item_group"], after_name=token["name"])
+        offset = 0
+    else:
+        total = frappe.db.sql(f"select count(*) from `tabItem` where {where}", values)[0][0]
+        seen = offset
+        page_where = where
+
+    values.update(limit=limit, offset=offset)
+    columns = ", ".join(f"`{field}`" for field in get_item_fields(fields))
+    items = frappe.db.sql(
+        f"""
+        select {columns}
+        from `tabItem`
+        where {page_where}
+        order by item_group, name
+        limit %(limit)s offset %(offset)s
+        """,
+        values,
+        as_dict=True,
+    )
+
+    seen += len(items)
+    remaining = max(total - seen, 0)
+    next_page_token = None
+    if items and remaining:
+        next_page_token = encode_page_token(
+            {
+                "item_group": items[-1].item_group,
+                "name": items[-1].name,
+                "total": total,
+                "seen": seen,
+            }
+        )
+
+    result = build_grouped_items(items, price_list or get_pos_price_list(pos_profile), fields)
+    return Response(
+        json.dumps(
+            {
+                "data": result,
+                "next_page_token": next_page_token,
+                "total": total,
+                "remaining": remaining,
+            }
+        ),
+        status=200,
+        mimetype="application/json",
+    )
+
+
+@frappe.whitelist(allow_guest=True)
+def get_items_stream(pos_profile=None, batch_size=500):
+    """
+    Streams the catalog as newline-delimited JSON.
 
-    # Convert limit and offset to integers
+    The first line is a header with the price list and change log cursor, then
+    an "item_group" line before the items of each group, one "item" line per
+    item in the get_items item shape, and a closing "end" line with the count.
+    Items are read and serialized one batch at a time while the response is
+    being sent.
+    """
     try:
-        limit = int(limit)
-        offset = int(offset)
+        batch_size = int(batch_size)
     except ValueError:
         return Response(
-            json.dumps({"error": "Invalid limit or offset. Must be integers."}),
+            json.dumps({"error": "Invalid batch_size. Must be an integer."}),
             status=400,
             mimetype="application/json",
         )
 
-    items = frappe.get_all(
-        "Item",
-        fields=fields,
-        filters=item_filters,
-        limit_page_length=limit,
-        limit_start=offset,
-    )
-
-    item_meta = frappe.get_meta("Item")
-    has_arabic = "custom_item_name_arabic" in [df.fieldname for df in item_meta.fields]
-    has_english = "custom_item_name_in_english" in [
-        df.fieldname for df in item_meta.fields
-    ]
-
-    grouped_items = {}
+    # The request's database connection is closed before the body is sent,
+    # the generator opens its own for the site.
+    site = frappe.local.site
+    sites_path = frappe.local.sites_path
 
-    for item in items:
-        item_doc = frappe.get_doc("Item", item.name)
+    def generate():
+        frappe.init(site=site, sites_path=sites_path)
+        frappe.connect()
+        try:
+            price_list = get_pos_price_list(pos_profile)
+            header = {"type": "header", "price_list": price_list, "cursor": get_last_change_seq()}
+            yield json.dumps(header) + "\n"
+
+            count = 0
+            current_group = None
+            for items in iter_item_batches(get_pos_item_groups(pos_profile), batch_size):
+                lines = []
+                for group in build_grouped_items(items, price_list):
+                    if group["item_group"] != current_group:
+                        current_group = group["item_group"]
+                        group_line = {key: value for key, value in group.items() if key != "items"}
+                        group_line["type"] = "item_group"
+                        lines.append(json.dumps(group_line))
+                    for item in group["items"]:
+                        item["type"] = "item"
+                        item["item_group"] = group["item_group"]
+                        lines.append(json.dumps(item))
+                        count += 1
+                yield "\n".join(lines) + "\n"
+
+            yield json.dumps({"type": "end", "count": count}) + "\n"
+        finally:
+            frappe.destroy()
 
-        item_name_arabic = ""
-        item_name_english = ""
+    return Response(
+        generate(),
+        status=200,
+        mimetype="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+        direct_passthrough=True,
+    )
 
-        if has_arabic and item_doc.get("custom_item_name_arabic"):
-            item_name_arabic = item_doc.custom_item_name_arabic
-            item_name_english = item.item_name
-        elif has_english and item_doc.get("custom_item_name_in_english"):
-            item_name_arabic = item.item_name
-            item_name_english = item_doc.custom_item_name_in_english
 
-        uoms = frappe.get_all(
-            "UOM Conversion Detail",
-            filters={"parent": item.name},
-            fields=["uom", "conversion_factor"],
-        )
-        barcodes = frappe.get_all(
-            "Item Barcode",
-            filters={"parent": item.name},
-            fields=["barcode", "uom"],
+@frappe.whitelist(allow_guest=True)
+def get_items_manifest(pos_profile=None):
+    """
+    Lists the catalog as one shard per item group with its item count,
+    version and size in bytes. Terminals fetch the shards whose version
+    changed with get_items_shard, in parallel, and retry only the failed ones.
+    """
+    try:
+        meta = get_catalog_meta(pos_profile)
+        shards = [
+            {
+                "item_group": item_group,
+                "count": hashes["count"],
+                "version": hashes["hash"],
+                "size": hashes["size"],
+            }
+            for item_group, hashes in get_catalog_hashes(pos_profile).items()
+        ]
+        return Response(
+            json.dumps(
+                {
+                    "data": shards,
+                    "version": meta["version"],
+                    "cursor": meta["cursor"],
+                }
+            ),
+            status=200,
+            mimetype="application/json",
         )
-        item_prices = frappe.get_all(
-            "Item Price",
-            fields=["price_list_rate", "uom"],
-            filters={"item_code": item.name},
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "get_items_manifest error")
+        return Response(
+            json.dumps({"error": str(e)}),
+            status=500,
+            mimetype="application/json",
         )
 
-        price_map = {price["uom"]: price["price_list_rate"] for price in item_prices}
-        # Group barcodes by UOM
-        barcode_map = {}
-        for barcode in barcodes:
-            if barcode.uom in barcode_map:
-                barcode_map[barcode.uom].append(barcode.barcode)
-            else:
-                barcode_map[barcode.uom] = [barcode.barcode]
 
-        if item.item_group not in grouped_items:
-            grouped_items[item.item_group] = {
-                "item_group_id": item.item_group,
-                "item_group": item.item_group,
-                "items": [],
-            }
+@frappe.whitelist(allow_guest=True)
+def get_items_shard(item_group, pos_profile=None, version=None):
+    """
+    One item group of the catalog in the get_items shape. When `version`
+    matches the current shard version a 304 is returned without a body.
+    """
+    try:
+        shard = get_catalog_shard(pos_profile, item_group)
+        if not shard:
+            return Response(
+                json.dumps({"error": "Item group not found"}),
+                status=404,
+                mimetype="application/json",
+            )
+        if version and version == shard["version"]:
+            return Response(status=304, headers={"ETag": shard["version"]})
 
-        grouped_items[item.item_group]["items"].append(
-            {
-                "item_id": item.name,
-                "item_code": item.name,
-                "item_name": item.item_name,
-                "item_name_english": item_name_english,
-                "item_name_arabic": item_name_arabic,
-                "tax_percentage": (item_doc.get("custom_tax_percentage") or 0.0),
-                "description": item.description,
-                "barcodes": [
-                    {"barcode": barcode["barcode"], "uom": barcode["uom"]}
-                    for barcode in barcodes
-                ],
-                "uom": [
-                    {
-                        "uom": uom["uom"],
-                        "conversion_factor": uom["conversion_factor"],
-                        "price": price_map.get(uom["uom"], 0.0),
-                        "barcode": ", ".join(barcode_map.get(uom.uom, [])),
-                    }
-                    for uom in uoms
-                ],
-            }
+        return Response(
+            '{"data": %s, "version": "%s"}' % (shard["data"], shard["version"]),
+            status=200,
+            mimetype="application/json",
+            headers={"ETag": shard["version"]},
+        )
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "get_items_shard error")
+        return Response(
+            json.dumps({"error": str(e)}),
+            status=500,
+            mimetype="application/json",
         )
-
-    result = list(grouped_items.values())
-    return Response(
-        json.dumps({"data": result}), status=200, mimetype="application/json"
-    )
 
 
 @frappe.whitelist()
@@ -733,9 +748,70 @@ def cache2():
     return doc1
 
 
+# Assembled pos_setting data per (machine_name, pos_profile), dropped
+# whenever one of the documents it is built from is saved. The PIH is not
+# part of it: invoices move it forward with frappe.db.set_value, which fires
+# no hook, so it is read on every call.
+POS_SETTING_PAYLOADS = "gpos_pos_setting_payloads"
+
+
+def on_pos_setting_source_change(doc, method=None):
+    frappe.cache().delete_value(POS_SETTING_PAYLOADS)
+
+
 @frappe.whitelist(allow_guest=True)
 def pos_setting(machine_name, pos_profile=None):
-    systemSettings = frappe.get_doc("Claudion POS setting")
+    """
+    Terminal bootstrap settings. The payload is served from cache with an
+    ETag, a matching If-None-Match gets a 304.
+    """
+    payload = get_pos_setting_payload(machine_name, pos_profile)
+    if frappe.get_request_header("If-None-Match") == payload["etag"]:
+        return Response(status=304, headers={"ETag": payload["etag"]})
+    return Response(
+        payload["body"],
+        status=200,
+        mimetype="application/json",
+        headers={"ETag": payload["etag"]},
+    )
+
+
+def get_pos_setting_payload(machine_name, pos_profile=None):
+    """
+    {"etag": ..., "body": ...} of the pos_setting response, from cache
+    with the current PIH.
+    """
+    data = frappe.cache().hget(
+        POS_SETTING_PAYLOADS,
+        f"{machine_name or ''}|{pos_profile or ''}",
+        generator=lambda: get_pos_setting_data(machine_name, pos_profile),
+    )
+    data["zatca"]["pih"] = get_current_pih(machine_name, data["zatca"]["phase"])
+    body = json.dumps({"data": data})
+    return {"etag": '"%s"' % hashlib.md5(body.encode("utf-8")).hexdigest(), "body": body}
+
+
+def get_current_pih(machine_name, phase):
+    """
+    PIH the next invoice of a machine chains to, as get_pos_setting_data picks it.
+    """
+    if phase != "Phase-2" or not machine_name:
+        return None
+    setting = frappe.db.get_value(
+        "ZATCA Multiple Setting",
+        machine_name,
+        ["custom__use_company_certificate__keys", "custom_linked_doctype", "custom_pih"],
+        as_dict=True,
+    )
+    if not setting:
+        return None
+    if setting.custom__use_company_certificate__keys:
+        return frappe.db.get_value("Company", setting.custom_linked_doctype, "custom_pih")
+    return setting.custom_pih
+
+
+def get_pos_setting_data(machine_name, pos_profile=None):
+    systemSettings = get_settings("Claudion POS setting")
     var = True if systemSettings.show_item == 1 else False
     Zatca_Multiple_Setting = (
         frappe.get_doc("ZATCA Multiple Setting", machine_name) if machine_name else None
@@ -905,7 +981,7 @@ def pos_setting(machine_name, pos_profile=None):
         "branch_details": branch_details,
     }
 
-    return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
+    return data
 
 @frappe.whitelist(allow_guest=True)
 def warehouse_details(id=None):
@@ -980,10 +1056,6 @@ def wallet_refund_request(user, amount, transaction_id=None):
 def generate_token_secure_for_users(username, password, app_key):
 
     # return Response(json.dumps({"message": "2222 Security Parameters are not valid" , "user_count": 0}), status=401, mimetype='application/json')
-    frappe.log_error(
-        title="Login attempt",
-        message=str(username) + "    " + str(password) + "    " + str(app_key + "  "),
-    )
     try:
         try:
             app_key = base64.b64decode(app_key).decode("utf-8")
@@ -995,13 +1067,10 @@ def generate_token_secure_for_users(username, password, app_key):
                 status=401,
                 mimetype="application/json",
             )
-        clientID, clientSecret, clientUser = frappe.db.get_value(
-            "OAuth Client",
-            {"app_name": app_key},
-            ["client_id", "client_secret", "user"],
-        )
+        token = get_password_token(app_key, username, password)
 
-        if clientID is None:
+        if token is None:
+            audit_login(username, app_key, "Invalid app key")
             # return app_key
             return Response(
                 json.dumps(
@@ -1011,39 +1080,16 @@ def generate_token_secure_for_users(username, password, app_key):
                 mimetype="application/json",
             )
 
-        client_id = clientID
-        client_secret = clientSecret
-        url = (
-            frappe.local.conf.host_name
-            + "/api/method/frappe.integrations.oauth2.get_token"
-        )
-        payload = {
-            "username": username,
-            "password": password,
-            "grant_type": "password",
-            "client_id": client_id,
-            "client_secret": client_secret,
-            # "grant_type": "refresh_token"
-        }
-        files = []
-        headers = {"Content-Type": "application/json"}
-        response = requests.request("POST", url, data=payload, files=files)
-        # var = frappe.get_list("Customer", fields=["name as id", "full_name","email", "mobile_no as phone",], filters={'name': ['like', username]})
-        qid = frappe.get_list(
-            "User",
-            fields=["name as id", "Full Name", "mobile_no as phone", "email"],
-            filters={"name": ["like", username]},
-        )
-        systemSettings = frappe.get_doc("Claudion POS setting")
-        if response.status_code == 200:
-
-            response_data = json.loads(response.text)
+        status, response_data = token
+        audit_login(username, app_key, "Success" if status == 200 else "Failed")
+        if status == 200:
 
+            profile = get_login_profile(username)
             result = {
                 "token": response_data,
-                "user": qid[0] if qid else {},
+                "user": profile["user"],
                 "time": str(now_datetime()),
-                "branch_id": systemSettings.branch,
+                "branch_id": profile["branch_id"],
             }
             return Response(
                 json.dumps({"data": result}), status=200, mimetype="application/json"
@@ -1051,19 +1097,39 @@ def generate_token_secure_for_users(username, password, app_key):
         else:
 
             frappe.local.response.http_status_code = 401
-            return json.loads(response.text)
+            return response_data
 
     except Exception as e:
 
         return Response(
-            json.dumps({"message": e, "user_count": 0}),
+            json.dumps({"message": str(e), "user_count": 0}),
             status=500,
             mimetype="application/json",
         )
 
 
 @frappe.whitelist(allow_guest=True)
-def getOfflinePOSUsers(id=None, offset=0, limit=500):
+def getOfflinePOSUsers(id=None, offset=0, limit=500, dedupe_templates=0):
+    """
+    Offline users with their passwords, POS Profiles and print template.
+
+    Passwords, POS Profile memberships and print formats are each read with
+    one query. With dedupe_templates each user's print_template is the hash
+    of a template in the top-level "templates" map instead of the HTML. The
+    response has an ETag, a matching If-None-Match gets a 304.
+    """
+    body = json.dumps(get_offline_pos_users_payload(offset, limit, dedupe_templates))
+
+    etag = '"%s"' % hashlib.md5(body.encode("utf-8")).hexdigest()
+    if frappe.get_request_header("If-None-Match") == etag:
+        return Response(status=304, headers={"ETag": etag})
+    return Response(body, status=200, mimetype="application/json", headers={"ETag": etag})
+
+
+def get_offline_pos_users_payload(offset=0, limit=500, dedupe_templates=0):
+    """
+    {"data": [...]} of getOfflinePOSUsers, with "templates" when dedupe_templates is set.
+    """
     docs = frappe.db.get_all(
         "POS Offline Users",
         fields=[
@@ -1083,40 +1149,71 @@ def getOfflinePOSUsers(id=None, offset=0, limit=500):
         limit_page_length=limit,
     )
 
-    for doc in docs:
-        # Decrypt and encode password
-        decrypted_password = get_decrypted_password(
-            "POS Offline Users", doc.name, "password"
+    passwords = {}
+    if docs:
+        for name, password in frappe.db.sql(
+            """
+            select name, password from `__Auth`
+            where doctype = 'POS Offline Users' and fieldname = 'password'
+                and encrypted = 1 and name in %(names)s
+            """,
+            {"names": tuple(doc.name for doc in docs)},
+        ):
+            passwords[name] = decrypt(password)
+
+    users = list({doc.actual_user_name for doc in docs if doc.actual_user_name})
+    pos_profiles = {}
+    if users:
+        for row in frappe.db.get_all(
+            "POS Profile User",
+            filters={"user": ["in", users]},
+            fields=["user", "parent as pos_profile"],
+        ):
+            pos_profiles.setdefault(row.user, []).append(row.pos_profile)
+
+    print_formats = list({doc.custom_print_format for doc in docs if doc.custom_print_format})
+    print_format_html = {}
+    if print_formats:
+        print_format_html = dict(
+            frappe.db.get_all(
+                "Print Format",
+                filters={"name": ["in", print_formats]},
+                fields=["name", "html"],
+                as_list=True,
+            )
         )
+
+    templates = {}
+    for doc in docs:
+        decrypted_password = passwords.get(doc.name, "")
         doc["password"] = base64.b64encode(decrypted_password.encode("utf-8")).decode(
             "utf-8"
         )
 
-        # Get POS Profiles for the user
-        pos_profiles = frappe.db.get_all(
-            "POS Profile User",
-            filters={"user": doc["actual_user_name"]},
-            fields=["parent as pos_profile"],
-        )
-        doc["pos_profiles"] = [p["pos_profile"] for p in pos_profiles]
+        doc["pos_profiles"] = pos_profiles.get(doc["actual_user_name"], [])
 
         # Determine the correct print_format value
         if doc.get("print_template"):
             doc["print_template"] = doc["print_template"]
         elif doc.get("custom_print_format"):
-            html = frappe.db.get_value(
-                "Print Format", doc["custom_print_format"], "html"
-            )
-            doc["print_template"] = html
+            doc["print_template"] = print_format_html.get(doc["custom_print_format"])
         else:
             doc["print_template"] = None
 
+        if cint(dedupe_templates) and doc["print_template"]:
+            template_hash = hashlib.md5(doc["print_template"].encode("utf-8")).hexdigest()
+            templates[template_hash] = doc["print_template"]
+            doc["print_template"] = template_hash
+
         # Clean up if needed
         # doc.pop("print_template", None)
         # doc.pop("custom_print_format", None)
         doc["custom_is_admin"] = bool(doc.get("custom_is_admin", 0))
 
-    return Response(json.dumps({"data": docs}), status=200, mimetype="application/json")
+    payload = {"data": docs}
+    if cint(dedupe_templates):
+        payload["templates"] = templates
+    return payload
 
 
 @frappe.whitelist(allow_guest=True)
@@ -1281,7 +1378,7 @@ def create_invoice(
 
 ):
     try:
-        pos_settings = frappe.get_doc("Claudion POS setting")
+        pos_settings = get_settings("Claudion POS setting")
 
         items = parse_json_field(frappe.form_dict.get("items"))
         payments = parse_json_field(frappe.form_dict.get("payments"))
@@ -1341,21 +1438,14 @@ def create_invoice(
             if not pos_profile_doc.get("taxes_and_charges") and pos_settings.get(
                 "sales_taxes_and_charges"
             ):
-                taxes_list = [
-                    {
-                        "charge_type": tax.charge_type,
-                        "account_head": tax.account_head,
-                        "rate": tax.rate,
-                        "description": tax.description,
-                    }
-                    for tax in pos_settings.get("sales_taxes_and_charges")
-                ]
+                taxes_list = [dict(tax) for tax in pos_settings.taxes]
 
+        existing_item_codes = get_existing_item_codes(item.get("item_code") for item in items)
         invoice_items = [
             {
                 "item_code": (
                     item["item_code"]
-                    if frappe.get_value("Item", {"name": item["item_code"]}, "name")
+                    if item["item_code"] in existing_item_codes
                     else None
                 ),
                 "qty": item.get("quantity", 0),
@@ -1763,7 +1853,7 @@ def create_credit_note(
     reason=None,
 ):
     try:
-        pos_settings = frappe.get_doc("Claudion POS setting")
+        pos_settings = get_settings("Claudion POS setting")
 
         items = parse_json_field(frappe.form_dict.get("items"))
         payments = parse_json_field(frappe.form_dict.get("payments"))
@@ -1845,11 +1935,12 @@ def create_credit_note(
             source_warehouse = pos_doc.warehouse
             profile_taxes_and_charges = pos_doc.taxes_and_charges
             profile_discount_account = pos_doc.custom_discount_account
+        existing_item_codes = get_existing_item_codes(item.get("item_code") for item in items)
         invoice_items = [
             {
                 "item_code": (
                     item["item_code"]
-                    if frappe.get_value("Item", {"name": item["item_code"]}, "name")
+                    if item["item_code"] in existing_item_codes
                     else None
                 ),
                 "qty": item.get("quantity", 0),
@@ -2109,104 +2200,108 @@ def get_promotion_list(pos_profile):
                 mimetype="application/json",
             )
 
-        today = datetime.today().date()
+        result = get_promotion_list_data(pos_profile)
+        if not result:
+            return Response(
+                json.dumps({"error": "This POS Profile is not linked to any promotions"}),
+                status=404,
+                mimetype="application/json",
+            )
 
-        promotions = frappe.get_all(
-            "promotion",
-            filters={"valid_upto": (">=", today),
-                     "docstatus":1,
-                     "enabled":1},
-            fields=["name", "company", "valid_from", "valid_upto"],
+        return Response(
+            json.dumps({"data": result}, default=str),
+            status=200,
+            mimetype="application/json",
         )
 
-        result = []
-        linked_to_any_promotion = False
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "get_promotion_list error")
+        return Response(
+            json.dumps({"error": str(e)}),
+            status=500,
+            mimetype="application/json",
+        )
 
-        for promo in promotions:
-            doc = frappe.get_doc("promotion", promo.name)
-            pos_profiles = [row.pos_profile for row in doc.pos_profile_table]
 
-            if pos_profile not in pos_profiles:
-                continue
+def get_promotion_list_data(pos_profile):
+    """
+    The get_promotion_list data, empty when the POS Profile is not linked to
+    any active promotion.
+    """
+    today = datetime.today().date()
+
+    promotions = frappe.get_all(
+        "promotion",
+        filters={"valid_upto": (">=", today),
+                 "docstatus":1,
+                 "enabled":1},
+        fields=["name", "company", "valid_from", "valid_upto"],
+    )
 
-            linked_to_any_promotion = True
+    result = []
 
-            item_table = []
-            for item in doc.item_table:
-                item_doc = frappe.get_doc("Item", item.item_code)
+    for promo in promotions:
+        doc = frappe.get_doc("promotion", promo.name)
+        pos_profiles = [row.pos_profile for row in doc.pos_profile_table]
 
+        if pos_profile not in pos_profiles:
+            continue
 
-                matched_uom_row = None
-                for uom_row in item_doc.uoms:
-                    if uom_row.uom == item.uom:
-                        matched_uom_row = uom_row
-                        break
+        item_table = []
+        for item in doc.item_table:
+            item_doc = frappe.get_doc("Item", item.item_code)
 
-                item_table.append(
-                    {
-                        "id": item.name,
-                        "item_code": item.item_code,
-                        "item_name": item.item_name,
-                        "sale_price":float(item.sale_price) if item.sale_price is not None else None,
-                        "cost_price":float(item.cost_price)if item.cost_price is not None else None,
-                        "discount_type": (
-                            "PERCENTAGE"
-                            if item.discount_type == "Discount Percentage"
-                            else (
-                                "AMOUNT"
-                                if item.discount_type == "Discount Amount"
-                                else (
-                                    "RATE"
-                                    if item.discount_type == "Rate"
-                                    else item.discount_type
-                                )
-                            )
-                        ),
-                        "min_qty": item.min_qty,
-                        "max_qty": item.max_qty,
-                        "discount_percentage": item.discount_percentage,
-                        "discount_price": item.discount__amount,
-                        "price_after_discount":float(item.price_after_discount) if item.price_after_discount is not None else None,
-                        "uom_id": matched_uom_row.name if matched_uom_row else None,
-                        "uom": item.uom,
-                    }
-                )
 
-            profile_doc = frappe.get_doc("POS Profile", pos_profile)
+            matched_uom_row = None
+            for uom_row in item_doc.uoms:
+                if uom_row.uom == item.uom:
+                    matched_uom_row = uom_row
+                    break
 
-            result.append(
+            item_table.append(
                 {
-                    "id": doc.name,
-                    "company": doc.company,
-                    "disabled": profile_doc.disabled,
-                    "valid_from": str(doc.valid_from),
-                    "valid_upto": str(doc.valid_upto),
-                    "items": item_table,
+                    "id": item.name,
+                    "item_code": item.item_code,
+                    "item_name": item.item_name,
+                    "sale_price":float(item.sale_price) if item.sale_price is not None else None,
+                    "cost_price":float(item.cost_price)if item.cost_price is not None else None,
+                    "discount_type": (
+                        "PERCENTAGE"
+                        if item.discount_type == "Discount Percentage"
+                        else (
+                            "AMOUNT"
+                            if item.discount_type == "Discount Amount"
+                            else (
+                                "RATE"
+                                if item.discount_type == "Rate"
+                                else item.discount_type
+                            )
+                        )
+                    ),
+                    "min_qty": item.min_qty,
+                    "max_qty": item.max_qty,
+                    "discount_percentage": item.discount_percentage,
+                    "discount_price": item.discount__amount,
+                    "price_after_discount":float(item.price_after_discount) if item.price_after_discount is not None else None,
+                    "uom_id": matched_uom_row.name if matched_uom_row else None,
+                    "uom": item.uom,
                 }
             )
 
-        if not linked_to_any_promotion:
-            return Response(
-                json.dumps(
-                    {"error": "This POS Profile is not linked to any promotions"}
-                ),
-                status=404,
-                mimetype="application/json",
-            )
+        profile_doc = frappe.get_doc("POS Profile", pos_profile)
 
-        return Response(
-            json.dumps({"data": result}, default=str),
-            status=200,
-            mimetype="application/json",
+        result.append(
+            {
+                "id": doc.name,
+                "company": doc.company,
+                "disabled": profile_doc.disabled,
+                "valid_from": str(doc.valid_from),
+                "valid_upto": str(doc.valid_upto),
+                "items": item_table,
+            }
         )
 
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "get_promotion_list error")
-        return Response(
-            json.dumps({"error": str(e)}),
-            status=500,
-            mimetype="application/json",
-        )
+    return result
 
 
 @frappe.whitelist(allow_guest=True)
@@ -2334,116 +2429,102 @@ def create_customer_new(
 @frappe.whitelist()
 def customer_list(id=None, pos_profile=None):
     try:
-        filters = {"name": id} if id else {}
-        customers = frappe.get_list(
-            "Customer",
-            fields=[
-                "name as id",
-                "customer_name",
-                "mobile_no",
-                "email_id",
-                "tax_id",
-                "customer_group",
-                "territory",
-                "customer_primary_address",
-                "custom_default_pos",
-                "disabled",
-                "custom_b2c",
-                "custom_buyer_id_type",
-                "custom_buyer_id"
-            ],
-            filters=filters,
-        )
+        if pos_profile and not frappe.db.exists("POS Profile", pos_profile):
+            return Response(json.dumps({"error": "POS Profile not found"}), status=404, mimetype="application/json")
 
-        if not customers:
-            return Response(
-                json.dumps({"error": "Customer not found"}),
-                status=404,
-                mimetype="application/json",
-            )
-
-
-        if not pos_profile:
-            return Response(
-                json.dumps({"data": customers}),
-                status=200,
-                mimetype="application/json",
-            )
+        data = get_customer_list_data(id, pos_profile)
+        if not data:
+            error = "No customers found for given POS Profile" if pos_profile and not id else "Customer not found"
+            return Response(json.dumps({"error": error}), status=404, mimetype="application/json")
 
+        return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
+    except Exception as e:
+        return Response(json.dumps({"error": str(e)}), status=500, mimetype="application/json")
 
-        if not frappe.db.exists("POS Profile", pos_profile):
-            return Response(
-                json.dumps({"error": "POS Profile not found"}),
-                status=404,
-                mimetype="application/json",
-            )
 
-        default_customer = frappe.db.get_value("POS Profile", pos_profile, "customer")
+def get_customer_list_data(id=None, pos_profile=None):
+    """
+    The customer_list data, empty when no customer matches.
+    """
+    filters = {"name": id} if id else {}
+    customers = frappe.get_list(
+        "Customer",
+        fields=[
+            "name as id",
+            "customer_name",
+            "mobile_no",
+            "email_id",
+            "tax_id",
+            "customer_group",
+            "territory",
+            "customer_primary_address",
+            "custom_default_pos",
+            "disabled",
+            "custom_b2c",
+            "custom_buyer_id_type",
+            "custom_buyer_id"
+        ],
+        filters=filters,
+    )
 
-        filtered_customers = []
-        for cust in customers:
-            cust["custom_default_pos"] = 0
+    if not customers or not pos_profile:
+        return customers
 
+    default_customer = frappe.db.get_value("POS Profile", pos_profile, "customer")
 
-            if default_customer and cust["id"] == default_customer:
-                pos_profiles = frappe.get_all(
-                "pos profile child table",
-                filters={"parent": cust["id"], "pos_profile": pos_profile},
-                fields=["pos_profile"],
-                )
-                if pos_profiles:
-                    cust["custom_default_pos"] = 1
-                    filtered_customers.append(cust)
-                    continue
+    filtered_customers = []
+    for cust in customers:
+        cust["custom_default_pos"] = 0
 
 
+        if default_customer and cust["id"] == default_customer:
             pos_profiles = frappe.get_all(
-                "pos profile child table",
-                filters={"parent": cust["id"], "pos_profile": pos_profile},
-                fields=["pos_profile"],
+            "pos profile child table",
+            filters={"parent": cust["id"], "pos_profile": pos_profile},
+            fields=["pos_profile"],
             )
-
             if pos_profiles:
+                cust["custom_default_pos"] = 1
                 filtered_customers.append(cust)
+                continue
 
-        if not filtered_customers:
-            return Response(
-                json.dumps({"error": "No customers found for given POS Profile"}),
-                status=404,
-                mimetype="application/json",
-            )
 
+        pos_profiles = frappe.get_all(
+            "pos profile child table",
+            filters={"parent": cust["id"], "pos_profile": pos_profile},
+            fields=["pos_profile"],
+        )
 
-        data = []
-        for customer in filtered_customers:
-            address_data = {}
-            if customer.customer_primary_address:
-                address = frappe.get_doc("Address", customer.customer_primary_address)
-                address_data = {
-                    "address_1": address.address_line1,
-                    "address_2": address.address_line2,
-                    "building_no": int(address.custom_building_number) if address.custom_building_number else None,
-                    "pb_no": int(address.pincode) if address.pincode else None
-                }
+        if pos_profiles:
+            filtered_customers.append(cust)
 
-            data.append({
-                "id": customer.get("id"),
-                "customer_name": customer.get("customer_name"),
-                "phone_no": customer.get("mobile_no"),
-                "vat_number": customer.get("tax_id"),
-                "customer_group": customer.get("customer_group"),
-                "custom_default_pos": customer.get("custom_default_pos"),
-                "B2C":customer.get("custom_b2c"),
-                "buyer_id":customer.get("custom_buyer_id"),
-                "buyer_id_type":customer.get("custom_buyer_id_type"),
-                "disabled": customer.get("disabled"),
-                **address_data,
-            })
+    data = []
+    for customer in filtered_customers:
+        address_data = {}
+        if customer.customer_primary_address:
+            address = frappe.get_doc("Address", customer.customer_primary_address)
+            address_data = {
+                "address_1": address.address_line1,
+                "address_2": address.address_line2,
+                "building_no": int(address.custom_building_number) if address.custom_building_number else None,
+                "pb_no": int(address.pincode) if address.pincode else None
+            }
 
-        return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
+        data.append({
+            "id": customer.get("id"),
+            "customer_name": customer.get("customer_name"),
+            "phone_no": customer.get("mobile_no"),
+            "vat_number": customer.get("tax_id"),
+            "customer_group": customer.get("customer_group"),
+            "custom_default_pos": customer.get("custom_default_pos"),
+            "B2C":customer.get("custom_b2c"),
+            "buyer_id":customer.get("custom_buyer_id"),
+            "buyer_id_type":customer.get("custom_buyer_id_type"),
+            "disabled": customer.get("disabled"),
+            **address_data,
+        })
 
-    except Exception as e:
-        return Response(json.dumps({"error": str(e)}), status=500, mimetype="application/json")
+    return data
 
 
 
@@ -2618,7 +2699,7 @@ def handle_loyalty_points(invoice_name, customer_name, mobile_no):
 
     try:
         invoice_doc = frappe.get_doc("Sales Invoice", invoice_name)
-        loyalty_setting = frappe.get_single("Loyalty Point Setting")
+        loyalty_setting = get_settings("Loyalty Point Setting")
 
         loyalty_by_group = {}
         calculate_without_tax = loyalty_setting.get("loyalty_calculate_without_tax")
@@ -2777,9 +2858,10 @@ def validate_otp(mobile_no, otp):
 
 @frappe.whitelist(allow_guest=True)
 def send_message(mobile_no,otp):
-        url =frappe.get_doc('Whatsapp Saudi').get('message_url')
-        instance =frappe.get_doc('Whatsapp Saudi').get('instance_id')
-        token =frappe.get_doc('Whatsapp Saudi').get('token')
+        whatsapp_settings = get_settings("Whatsapp Saudi")
+        url = whatsapp_settings.get('message_url')
+        instance = whatsapp_settings.get('instance_id')
+        token = whatsapp_settings.get('token')
         recipients = get_receiver_phone_number(mobile_no)
         for receipt in recipients:
             number = receipt
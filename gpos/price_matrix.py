@@ -0,0 +1,279 @@
+import json
+from functools import partial
+
+import frappe
+from frappe.utils import add_days, getdate
+from werkzeug.wrappers import Response
+
+from gpos.gpos.catalog_index import get_catalog_index
+
+DEFAULT_PRICE_LIST = "Retail Price"
+
+# Each worker keeps a {item_code: {uom: price_list_rate}} matrix per site and
+# price list, loaded with one query. Item Price changes are appended to a
+# journal in the shared cache and replayed by every worker on its next lookup,
+# so a single price change does not reload the whole price list. When the
+# journal grows past PRICE_JOURNAL_LIMIT the base version is changed instead
+# and workers reload.
+#
+# The matrix holds the prices valid today by Item Price valid_from/valid_upto
+# and is reloaded when the date changes. Next to it a schedule lists the price
+# changes of the coming PRICE_SCHEDULE_DAYS, so terminals can switch prices
+# on their own at the start of the day.
+
+PRICE_MATRIX_VERSION = "gpos_price_matrix_version"
+PRICE_JOURNAL = "gpos_price_matrix_journal"
+PRICE_JOURNAL_LIMIT = 1000
+PRICE_SCHEDULE_DAYS = 14
+
+_price_matrices = {}
+
+
+def get_pos_price_list(pos_profile=None):
+    """
+    Selling price list of the POS Profile, falling back to Retail Price.
+    """
+    if not pos_profile:
+        return DEFAULT_PRICE_LIST
+    return (
+        frappe.get_cached_value("POS Profile", pos_profile, "selling_price_list")
+        or DEFAULT_PRICE_LIST
+    )
+
+
+def is_selling_price_list(price_list):
+    """
+    The guest price endpoints only quote selling price lists, never buying ones.
+    """
+    return bool(frappe.get_cached_value("Price List", price_list, "selling"))
+
+
+def price_list_not_allowed(price_list):
+    return Response(
+        json.dumps({"error": f"{price_list} is not a selling price list"}),
+        status=403,
+        mimetype="application/json",
+    )
+
+
+def get_matrix_version(price_list):
+    key = f"{PRICE_MATRIX_VERSION}|{price_list}"
+    version = frappe.cache().get_value(key)
+    if not version:
+        version = frappe.generate_hash(length=10)
+        frappe.cache().set_value(key, version)
+    return version
+
+
+def reset_price_matrix(price_list):
+    frappe.cache().delete_value(f"{PRICE_JOURNAL}|{price_list}")
+    frappe.cache().set_value(f"{PRICE_MATRIX_VERSION}|{price_list}", frappe.generate_hash(length=10))
+
+
+def is_price_valid(price, date):
+    return (not price.valid_from or getdate(price.valid_from) <= date) and (
+        not price.valid_upto or getdate(price.valid_upto) >= date
+    )
+
+
+def get_price_timeline(prices, date):
+    """
+    Returns (rate, schedule) for the Item Prices of one item and UOM, given in
+    creation order. rate is the price valid on `date`, the newest one winning,
+    and schedule the [{"from": date, "price": rate}] changes after it within
+    PRICE_SCHEDULE_DAYS. A price of None means the item has no price from then.
+    """
+    def rate_on(day):
+        rate = None
+        for price in prices:
+            if is_price_valid(price, day):
+                rate = price.price_list_rate
+        return rate
+
+    if not any(price.valid_from or price.valid_upto for price in prices):
+        return prices[-1].price_list_rate, []
+
+    horizon = add_days(date, PRICE_SCHEDULE_DAYS)
+    changes = set()
+    for price in prices:
+        if price.valid_from:
+            changes.add(getdate(price.valid_from))
+        if price.valid_upto:
+            changes.add(getdate(add_days(price.valid_upto, 1)))
+
+    rate = previous = rate_on(date)
+    schedule = []
+    for day in sorted(day for day in changes if date < day <= horizon):
+        day_rate = rate_on(day)
+        if day_rate != previous:
+            schedule.append({"from": str(day), "price": day_rate})
+            previous = day_rate
+    return rate, schedule
+
+
+def get_item_prices_by_uom(filters):
+    item_prices = frappe.get_all(
+        "Item Price",
+        fields=["item_code", "uom", "price_list_rate", "valid_from", "valid_upto"],
+        filters=filters,
+        order_by="creation",
+    )
+    grouped = {}
+    for price in item_prices:
+        grouped.setdefault((price.item_code, price.uom), []).append(price)
+    return grouped
+
+
+def load_price_matrix(price_list, date):
+    """
+    Returns ({item_code: {uom: price_list_rate}}, {item_code: {uom: schedule}})
+    for one price list on `date`. Only items with upcoming changes have a schedule.
+    """
+    matrix = {}
+    schedules = {}
+    for (item_code, uom), prices in get_item_prices_by_uom({"price_list": price_list}).items():
+        rate, schedule = get_price_timeline(prices, date)
+        if rate is not None:
+            matrix.setdefault(item_code, {})[uom] = rate
+        if schedule:
+            schedules.setdefault(item_code, {})[uom] = schedule
+    return matrix, schedules
+
+
+def apply_journal(cached, entries):
+    for entry in entries:
+        entry = json.loads(entry)
+        prices = cached["matrix"].setdefault(entry["item_code"], {})
+        schedules = cached["schedules"].setdefault(entry["item_code"], {})
+        if entry["rate"] is None:
+            prices.pop(entry["uom"], None)
+        else:
+            prices[entry["uom"]] = entry["rate"]
+        if entry.get("schedule"):
+            schedules[entry["uom"]] = entry["schedule"]
+        else:
+            schedules.pop(entry["uom"], None)
+
+
+def get_cached_prices(price_list):
+    version = get_matrix_version(price_list)
+    journal_key = f"{PRICE_JOURNAL}|{price_list}"
+    journal_length = frappe.cache().llen(journal_key)
+    date = getdate()
+
+    key = (frappe.local.site, price_list)
+    cached = _price_matrices.get(key)
+    if not cached or cached["version"] != version or cached["date"] != date:
+        # Journal entries written while loading are replayed again next time, which is harmless.
+        matrix, schedules = load_price_matrix(price_list, date)
+        cached = {
+            "version": version,
+            "date": date,
+            "applied": journal_length,
+            "matrix": matrix,
+            "schedules": schedules,
+        }
+        _price_matrices[key] = cached
+    elif journal_length > cached["applied"]:
+        apply_journal(cached, frappe.cache().lrange(journal_key, cached["applied"], journal_length - 1))
+        cached["applied"] = journal_length
+
+    return cached
+
+
+def get_price_matrix(price_list):
+    return get_cached_prices(price_list)["matrix"]
+
+
+def get_price_schedules(price_list):
+    """
+    {item_code: {uom: [{"from": date, "price": rate}]}} of the upcoming price changes.
+    """
+    return get_cached_prices(price_list)["schedules"]
+
+
+def get_price_lookup(price_list):
+    """
+    Prices of one price list read like a matrix, from the shared catalog index
+    when it is current and covers the price list, else from the price matrix.
+    """
+    index = get_catalog_index()
+    if index and index.has_price_list(price_list):
+        return index.get_prices(price_list)
+    return get_price_matrix(price_list)
+
+
+def get_prices(item_codes, price_lists):
+    """
+    {price_list: {item_code: {uom: price_list_rate}}} for the given items.
+    """
+    result = {}
+    for price_list in price_lists:
+        prices = get_price_lookup(price_list)
+        result[price_list] = {item_code: prices.get(item_code, {}) for item_code in item_codes}
+    return result
+
+
+def get_price(item_code, price_list, uom=None):
+    prices = get_price_lookup(price_list).get(item_code, {})
+    if uom:
+        return prices.get(uom)
+    return next(iter(prices.values()), None)
+
+
+def journal_price(item_code, uom, price_list, exclude=None):
+    filters = {"item_code": item_code, "uom": uom, "price_list": price_list}
+    if exclude:
+        filters["name"] = ["!=", exclude]
+    prices = get_item_prices_by_uom(filters).get((item_code, uom))
+    rate, schedule = get_price_timeline(prices, getdate()) if prices else (None, [])
+
+    journal_key = f"{PRICE_JOURNAL}|{price_list}"
+    if frappe.cache().llen(journal_key) >= PRICE_JOURNAL_LIMIT:
+        reset_price_matrix(price_list)
+        return
+    frappe.cache().rpush(
+        journal_key,
+        json.dumps({"item_code": item_code, "uom": uom, "rate": rate, "schedule": schedule}),
+    )
+
+
+def on_item_price_change(doc, method=None):
+    # Journaled after commit: a rolled back change is never pushed, and a
+    # worker loading the matrix before the push already sees the new price.
+    if method == "on_trash":
+        frappe.db.after_commit.add(partial(journal_price, doc.item_code, doc.uom, doc.price_list, exclude=doc.name))
+        return
+
+    before = doc.get_doc_before_save()
+    if before and (before.item_code, before.uom, before.price_list) != (doc.item_code, doc.uom, doc.price_list):
+        frappe.db.after_commit.add(
+            partial(journal_price, before.item_code, before.uom, before.price_list, exclude=doc.name)
+        )
+    frappe.db.after_commit.add(partial(journal_price, doc.item_code, doc.uom, doc.price_list))
+
+
+@frappe.whitelist(allow_guest=True)
+def get_item_prices(item_codes, price_lists=None, pos_profile=None):
+    """
+    Prices of many items in one call.
+
+    `item_codes` and `price_lists` are JSON lists. Without price_lists the POS
+    Profile's selling price list is used. Only selling price lists are quoted.
+    """
+    try:
+        item_codes = json.loads(item_codes) if isinstance(item_codes, str) else item_codes
+        price_lists = json.loads(price_lists) if isinstance(price_lists, str) else price_lists
+    except json.JSONDecodeError:
+        return Response(
+            json.dumps({"error": "item_codes and price_lists must be JSON lists"}),
+            status=400,
+            mimetype="application/json",
+        )
+
+    for price_list in price_lists or []:
+        if not is_selling_price_list(price_list):
+            return price_list_not_allowed(price_list)
+
+    data = get_prices(item_codes or [], price_lists or [get_pos_price_list(pos_profile)])
+    return Response(json.dumps({"data": data}), status=200, mimetype="application/json")
@@ -0,0 +1,109 @@
+import json
+
+import frappe
+from werkzeug.wrappers import Response
+
+from gpos.gpos.catalog import get_catalog_snapshot
+from gpos.gpos.catalog_db import enqueue_catalog_database, get_catalog_db_info
+from gpos.gpos.pos import (
+    get_customer_list_data,
+    get_offline_pos_users_payload,
+    get_pos_setting_payload,
+    get_promotion_list_data,
+)
+
+
+def build_section(errors, section, build, default):
+    """
+    Runs one part of the bundle. A failure is reported under errors[section]
+    and the part is left as `default` instead of failing the bundle.
+    """
+    try:
+        return build()
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), f"provision_terminals {section} error")
+        errors[section] = str(e)
+        return default
+
+
+@frappe.whitelist()
+def provision_terminals(machine_names, pos_profile):
+    """
+    Bootstrap bundle for several terminals of one POS Profile.
+
+    `machine_names` is a JSON list. The catalog, promotions, customers and
+    offline users are computed once and returned under "shared", the
+    pos_setting payload of each machine under "machines". The prebuilt
+    catalog database is included when ready, and queued otherwise. A shared
+    part that fails is left empty and its error is listed under "errors".
+    """
+    try:
+        machine_names = json.loads(machine_names) if isinstance(machine_names, str) else machine_names
+        if not isinstance(machine_names, list):
+            raise ValueError
+    except ValueError:
+        return Response(
+            json.dumps({"error": "machine_names must be a JSON list"}),
+            status=400,
+            mimetype="application/json",
+        )
+
+    if not frappe.db.exists("POS Profile", pos_profile):
+        return Response(
+            json.dumps({"error": "POS Profile not found"}),
+            status=404,
+            mimetype="application/json",
+        )
+
+    try:
+        snapshot = get_catalog_snapshot(pos_profile)
+
+        catalog_database = get_catalog_db_info(pos_profile)
+        if not catalog_database:
+            enqueue_catalog_database(pos_profile)
+
+        errors = {}
+        offline_users = build_section(
+            errors,
+            "offline_users",
+            lambda: get_offline_pos_users_payload(limit=0, dedupe_templates=1),
+            {"data": [], "templates": {}},
+        )
+        shared = {
+            "catalog": {
+                "version": snapshot["version"],
+                "cursor": snapshot["cursor"],
+                "price_list": snapshot["price_list"],
+            },
+            "catalog_database": catalog_database,
+            "promotions": build_section(errors, "promotions", lambda: get_promotion_list_data(pos_profile), []),
+            "customers": build_section(
+                errors, "customers", lambda: get_customer_list_data(pos_profile=pos_profile), []
+            ),
+            "offline_users": offline_users["data"],
+            "print_templates": offline_users["templates"],
+        }
+
+        machines = {}
+        for machine_name in machine_names:
+            try:
+                machines[machine_name] = json.loads(get_pos_setting_payload(machine_name, pos_profile)["body"])["data"]
+            except Exception as e:
+                machines[machine_name] = {"error": str(e)}
+
+        # The catalog items are already serialized in the snapshot and are spliced in as is.
+        body = '{"data": {"shared": %s, "items": %s, "machines": %s, "errors": %s}}' % (
+            json.dumps(shared, default=str),
+            snapshot["data"],
+            json.dumps(machines, default=str),
+            json.dumps(errors),
+        )
+        return Response(body, status=200, mimetype="application/json")
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "provision_terminals error")
+        return Response(
+            json.dumps({"error": str(e)}),
+            status=500,
+            mimetype="application/json",
+        )
@@ -0,0 +1,76 @@
+import frappe
+from frappe.utils import cint, flt
+
+# Single settings doctypes read on hot paths are kept per worker and per site
+# as plain dicts, next to a version stamp in the shared cache. Saving a settings
+# doctype changes its stamp and each worker rebuilds on its next read. The
+# returned settings are shared between requests, treat them as read-only.
+
+SETTINGS_VERSION = "gpos_settings_version"
+
+_settings = {}
+
+
+def build_claudion_pos_setting(doc):
+    settings = frappe._dict(doc.as_dict(no_default_fields=True))
+    settings.sales_taxes_and_charges = [frappe._dict(tax) for tax in settings.sales_taxes_and_charges or []]
+    # Sales Taxes and Charges rows as create_invoice posts them.
+    settings.taxes = [
+        {
+            "charge_type": tax.charge_type,
+            "account_head": tax.account_head,
+            "rate": tax.rate,
+            "description": tax.description,
+        }
+        for tax in settings.sales_taxes_and_charges
+    ]
+    return settings
+
+
+def build_loyalty_point_setting(doc):
+    settings = frappe._dict(doc.as_dict(no_default_fields=True))
+    for fieldname in (
+        "loyalty_calculate_without_tax",
+        "loyalty_redeem_only_on_next_purchase",
+        "loyalty_point_percentage_if_not_defined_in_item_group",
+        "valid_days",
+    ):
+        settings[fieldname] = cint(settings[fieldname])
+    settings.loyalty_percentage = flt(settings.loyalty_percentage)
+    return settings
+
+
+def build_whatsapp_saudi(doc):
+    return frappe._dict(doc.as_dict(no_default_fields=True))
+
+
+SETTINGS_BUILDERS = {
+    "Claudion POS setting": build_claudion_pos_setting,
+    "Loyalty Point Setting": build_loyalty_point_setting,
+    "Whatsapp Saudi": build_whatsapp_saudi,
+}
+
+
+def get_settings_version(doctype):
+    version = frappe.cache().hget(SETTINGS_VERSION, doctype)
+    if not version:
+        version = frappe.generate_hash(length=10)
+        frappe.cache().hset(SETTINGS_VERSION, doctype, version)
+    return version
+
+
+def get_settings(doctype):
+    """
+    Typed settings of one of the SETTINGS_BUILDERS single doctypes.
+    """
+    version = get_settings_version(doctype)
+    key = (frappe.local.site, doctype)
+    cached = _settings.get(key)
+    if not cached or cached[0] != version:
+        cached = (version, SETTINGS_BUILDERS[doctype](frappe.get_single(doctype)))
+        _settings[key] = cached
+    return cached[1]
+
+
+def on_settings_change(doc, method=None):
+    frappe.cache().hset(SETTINGS_VERSION, doc.doctype, frappe.generate_hash(length=10))
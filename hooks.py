@@ -237,7 +237,111 @@ fixtures = [
 
 scheduler_events = {
     "daily": [
-        "gpos.gpos.pos.expire_loyalty_points"
-    ]
+        "gpos.gpos.pos.expire_loyalty_points",
+        "gpos.gpos.catalog_sync.prune_catalog_change_log",
+        "gpos.gpos.catalog.queue_daily_catalog_warmup",
+        "gpos.gpos.catalog_index.enqueue_catalog_index_build",
+    ],
+    "hourly": [
+        "gpos.gpos.catalog_db.build_catalog_databases",
+    ],
+    "cron": {
+        "* * * * *": [
+            "gpos.gpos.catalog.warm_catalog_snapshots",
+            "gpos.gpos.catalog_sync.sequence_catalog_changes",
+            "gpos.gpos.login.flush_login_audit"
+        ]
+    },
 }
 
+doc_events = {
+    "Item": {
+        "on_update": [
+            "gpos.gpos.catalog.on_item_change",
+            "gpos.gpos.catalog_sync.log_item_change",
+            "gpos.gpos.barcode.on_item_change",
+            "gpos.gpos.item_search.on_item_change",
+            "gpos.gpos.catalog_index.on_catalog_change",
+        ],
+        "on_trash": [
+            "gpos.gpos.catalog.on_item_change",
+            "gpos.gpos.catalog_sync.log_item_change",
+            "gpos.gpos.barcode.on_item_change",
+            "gpos.gpos.item_search.on_item_change",
+            "gpos.gpos.catalog_index.on_catalog_change",
+        ],
+    },
+    "Item Price": {
+        "on_update": [
+            "gpos.gpos.catalog.on_item_price_change",
+            "gpos.gpos.catalog_sync.log_item_price_change",
+            "gpos.gpos.price_matrix.on_item_price_change",
+            "gpos.gpos.catalog_index.on_catalog_change",
+        ],
+        "on_trash": [
+            "gpos.gpos.catalog.on_item_price_change",
+            "gpos.gpos.catalog_sync.log_item_price_change",
+            "gpos.gpos.price_matrix.on_item_price_change",
+            "gpos.gpos.catalog_index.on_catalog_change",
+        ],
+    },
+    "Item Group": {
+        "on_update": "gpos.gpos.catalog.on_item_group_change",
+        "on_trash": "gpos.gpos.catalog.on_item_group_change",
+    },
+    "UOM": {
+        "on_update": "gpos.gpos.catalog.on_uom_change",
+    },
+    "POS Profile": {
+        "on_update": [
+            "gpos.gpos.catalog.on_pos_profile_change",
+            "gpos.gpos.pos.on_pos_setting_source_change",
+        ],
+        "on_trash": [
+            "gpos.gpos.catalog.on_pos_profile_change",
+            "gpos.gpos.pos.on_pos_setting_source_change",
+        ],
+    },
+    "User": {
+        "on_update": "gpos.gpos.login.on_user_change",
+        "on_trash": "gpos.gpos.login.on_user_change",
+    },
+    "Claudion POS setting": {
+        "on_update": [
+            "gpos.gpos.settings.on_settings_change",
+            "gpos.gpos.login.on_pos_setting_change",
+            "gpos.gpos.pos.on_pos_setting_source_change",
+        ],
+    },
+    "Loyalty Point Setting": {
+        "on_update": "gpos.gpos.settings.on_settings_change",
+    },
+    "Whatsapp Saudi": {
+        "on_update": "gpos.gpos.settings.on_settings_change",
+    },
+    "ZATCA Multiple Setting": {
+        "on_update": "gpos.gpos.pos.on_pos_setting_source_change",
+        "on_trash": "gpos.gpos.pos.on_pos_setting_source_change",
+    },
+    "Company": {
+        "on_update": "gpos.gpos.pos.on_pos_setting_source_change",
+        "on_trash": "gpos.gpos.pos.on_pos_setting_source_change",
+    },
+    "Address": {
+        "on_update": "gpos.gpos.pos.on_pos_setting_source_change",
+        "on_trash": "gpos.gpos.pos.on_pos_setting_source_change",
+    },
+    "CardPay Settings": {
+        "on_update": "gpos.gpos.pos.on_pos_setting_source_change",
+        "on_trash": "gpos.gpos.pos.on_pos_setting_source_change",
+    },
+    "OAuth Client": {
+        "on_update": "gpos.gpos.oauth.on_oauth_client_change",
+        "on_trash": "gpos.gpos.oauth.on_oauth_client_change",
+    },
+    "promotion": {
+        "on_submit": "gpos.gpos.catalog_sync.notify_promotion_change",
+        "on_update_after_submit": "gpos.gpos.catalog_sync.notify_promotion_change",
+        "on_cancel": "gpos.gpos.catalog_sync.notify_promotion_change",
+    },
+}
@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+    # get_items_page and the catalog batches seek and order by (item_group, name).
+    frappe.db.add_index("Item", ["item_group", "name"], index_name="item_group_name_index")
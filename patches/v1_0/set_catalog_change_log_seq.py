@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+    # Entries logged before `seq` existed keep their name as the sequence, the cursor terminals already hold.
+    frappe.db.sql("update `tabCatalog Change Log` set seq = name where seq is null")